@@ -0,0 +1,612 @@
+"""
+批量处理 - 处理器链组装与单张图片处理
+不依赖 PyQt5，GUI 与进程池中的工作进程共用
+"""
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+from core.entity.config import Config
+from core.entity.encoder import Encoder
+from core.entity.encoder import Rendition
+from core.entity.image_container import ImageContainer
+from core.entity.image_processor import ProcessorChain
+from init import MARGIN_PROCESSOR
+from init import PADDING_TO_ORIGINAL_RATIO_PROCESSOR
+from init import SHADOW_PROCESSOR
+from init import SIMPLE_PROCESSOR
+from init import config
+from init import layout_items_dict
+from utils import EXIFTOOL_POOL
+
+logger = logging.getLogger(__name__)
+
+
+def apply_overrides(config: Config, layout: str | None = None, quality: int | None = None,
+                    output_format: str | None = None) -> None:
+    """
+    用命令行参数覆盖配置文件中的设置
+    :param config: 配置对象
+    :param layout: 布局类型
+    :param quality: 图片质量
+    :param output_format: 输出格式
+    """
+    if layout is not None:
+        config.set_layout(layout)
+    if quality is not None:
+        config.set_quality(quality)
+    if output_format is not None:
+        config.set_output_format(output_format)
+
+
+def build_processor_chain(config: Config) -> ProcessorChain:
+    """
+    根据配置组装处理器链
+    :param config: 配置对象
+    :return: 处理器链
+    """
+    processor_chain = ProcessorChain()
+    layout_type = config.get_layout_type()
+    if config.has_shadow_enabled() and layout_type and 'square' != layout_type:
+        processor_chain.add(SHADOW_PROCESSOR)
+
+    if layout_type and layout_type in layout_items_dict:
+        processor_chain.add(layout_items_dict.get(layout_type).processor)
+    else:
+        processor_chain.add(SIMPLE_PROCESSOR)
+
+    if config.has_white_margin_enabled() and layout_type and 'watermark' in layout_type:
+        processor_chain.add(MARGIN_PROCESSOR)
+
+    if config.has_padding_with_original_ratio_enabled() and layout_type and 'square' != layout_type:
+        processor_chain.add(PADDING_TO_ORIGINAL_RATIO_PROCESSOR)
+    return processor_chain
+
+
+def process_image(config: Config, processor_chain: ProcessorChain, source_path: Path, output_dir,
+                  exif: dict | None = None) -> list[Path]:
+    """
+    处理单张图片并保存到输出目录
+    :param config: 配置对象
+    :param processor_chain: 处理器链
+    :param source_path: 图片路径
+    :param output_dir: 输出目录
+    :param exif: 预读的 exif 信息
+    :return: 输出路径列表，第一个为主输出，其后为额外尺寸的输出
+    """
+    container = ImageContainer(source_path, exif=exif)
+    container.is_use_equivalent_focal_length(config.use_equivalent_focal_length())
+    if config.is_convert_to_srgb():
+        container.convert_to_srgb()
+
+    # 应用处理器链
+    processor_chain.process(container)
+
+    # 保存处理后的图片
+    encoder = Encoder.from_config(config)
+    target_path = encoder.get_target_path(Path(output_dir).joinpath(source_path.name))
+    container.save(target_path, encoder=encoder)
+    # 额外尺寸从内存中的结果逐级缩小生成
+    outputs = [target_path]
+    renditions = Rendition.from_config(config)
+    if renditions:
+        outputs.extend(container.save_renditions(target_path, renditions))
+    container.close()
+    return outputs
+
+
+# 进程池中每个工作进程各自从 config.yaml 构建的处理器链
+_worker_processor_chain = None
+
+
+def _init_worker(overrides: dict) -> None:
+    global _worker_processor_chain
+    apply_overrides(config, **overrides)
+    _worker_processor_chain = build_processor_chain(config)
+
+
+def _process_in_worker(source_path: Path, output_dir, exif: dict | None = None) -> list[Path]:
+    return process_image(config, _worker_processor_chain, source_path, output_dir, exif)
+
+
+def create_process_pool(workers: int, overrides: dict | None = None) -> ProcessPoolExecutor:
+    """
+    创建进程池，工作进程之间只传递路径和结果
+    :param workers: 进程数
+    :param overrides: 需要在工作进程中覆盖的设置，参见 apply_overrides
+    :return: 进程池
+    """
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(overrides or {},))
+
+
+def submit_to_process_pool(executor: ProcessPoolExecutor, source_path: Path, output_dir, exif: dict | None = None):
+    """
+    将单张图片提交到进程池
+    :return: Future，结果为输出路径列表，参见 process_image
+    """
+    return executor.submit(_process_in_worker, source_path, output_dir, exif)
+
+
+def read_image_size(source_path: Path) -> tuple[int, int] | None:
+    """
+    只读取文件头获取图片尺寸，不解码像素
+    :param source_path: 图片路径
+    :return: (宽, 高)，无法读取时返回 None
+    """
+    try:
+        with Image.open(source_path) as img:
+            return img.size
+    except OSError:
+        return None
+
+
+class MemoryBudget(object):
+    """
+    内存预算：新任务只有在已开始任务的估算内存与其之和不超过预算时才会开始，
+    没有任务在处理时总是放行，避免单张超大图片永远无法开始；
+    等待的任务按先来先到的顺序放行，大图不会被源源不断的小图一直插队
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+        :param max_bytes: 预算上限，单位为字节，0 表示不限制
+        """
+        self.max_bytes = max_bytes
+        self.in_use = 0
+        self._condition = threading.Condition()
+        # 等待中的任务的排队号，只有队首可以开始
+        self._waiters = deque()
+        self._next_ticket = 0
+
+    def acquire(self, size: int) -> None:
+        if not self.max_bytes:
+            return
+        with self._condition:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            self._waiters.append(ticket)
+            while self._waiters[0] != ticket or (self.in_use > 0 and self.in_use + size > self.max_bytes):
+                self._condition.wait()
+            self._waiters.popleft()
+            self.in_use += size
+            # 新的队首可能也放得下
+            self._condition.notify_all()
+
+    def release(self, size: int) -> None:
+        if not self.max_bytes:
+            return
+        with self._condition:
+            self.in_use -= size
+            self._condition.notify_all()
+
+
+def get_task_memory_budget(config: Config) -> int:
+    """
+    内存预算中留给处理中图片的部分：水印条和文字图块缓存常驻内存，先从预算中扣除
+    :param config: 配置对象
+    :return: 字节数，0 表示不限制
+    """
+    budget = config.get_memory_budget()
+    if not budget:
+        return 0
+    # 缓存占满整个预算时仍然一次处理一张
+    return max(budget - config.get_strip_cache_size() - config.get_text_cache_size(), 1)
+
+
+def get_render_signature(config: Config, processor_chain: ProcessorChain) -> str:
+    """
+    计算影响输出结果的设置的摘要，只包含处理器链实际用到的设置
+    :param config: 配置对象
+    :param processor_chain: 处理器链
+    :return: 摘要
+    """
+    signature = {
+        'chain': processor_chain.get_signature(),
+        'quality': config.get_quality(),
+        'output': config.get_output_settings(),
+        'use_equivalent_focal_length': config.use_equivalent_focal_length(),
+    }
+    return hashlib.sha256(json.dumps(signature, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def hash_file(path, chunk_size=1024 * 1024) -> str:
+    """
+    计算文件内容的摘要
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest(object):
+    """
+    增量处理清单：保存在输出目录中，记录每张图片处理时的大小、修改时间、内容摘要和设置摘要，
+    再次处理时跳过输出仍然有效的图片
+    """
+    FILE_NAME = '.semi-utils-manifest.json'
+    # 每记录这么多张图片写入一次，中途退出时不会丢失全部进度
+    SAVE_INTERVAL = 100
+
+    def __init__(self, output_dir):
+        self.path = Path(output_dir).joinpath(self.FILE_NAME)
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._dirty = False
+        self._unsaved = 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f'增量处理清单 {self.path} 读取失败，将重新处理所有图片: {e}')
+
+    def get_output(self, source_path: Path, signature: str) -> Path | None:
+        """
+        判断图片的输出是否仍然有效，主输出和各尺寸的输出都存在时才有效
+        :param source_path: 图片路径
+        :param signature: 设置摘要
+        :return: 有效时返回主输出路径，否则返回 None
+        """
+        key = str(Path(source_path).resolve())
+        with self._lock:
+            entry = self._entries.get(key)
+        # 旧版本的清单只记录了主输出，没有 outputs，按无效处理
+        if entry is None or entry['signature'] != signature or not entry.get('outputs') \
+                or not all(os.path.exists(output) for output in entry['outputs']):
+            return None
+        stat = os.stat(source_path)
+        if stat.st_size != entry['size']:
+            return None
+        if stat.st_mtime_ns != entry['mtime']:
+            # 只修改了时间（例如重新拷贝）时按内容判断
+            if hash_file(source_path) != entry['hash']:
+                return None
+            with self._lock:
+                entry['mtime'] = stat.st_mtime_ns
+                self._dirty = True
+        return Path(entry['outputs'][0])
+
+    def record(self, source_path: Path, signature: str, outputs: list[Path]) -> None:
+        """
+        记录处理完成的图片
+        :param source_path: 图片路径
+        :param signature: 设置摘要
+        :param outputs: 输出路径列表，第一个为主输出
+        """
+        stat = os.stat(source_path)
+        entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': hash_file(source_path),
+                 'signature': signature, 'outputs': [str(output) for output in outputs]}
+        with self._lock:
+            self._entries[str(Path(source_path).resolve())] = entry
+            self._dirty = True
+            self._unsaved += 1
+            need_save = self._unsaved >= self.SAVE_INTERVAL
+        if need_save:
+            self.save()
+
+    def save(self) -> None:
+        """
+        写入清单，先写临时文件再替换，中途退出不会损坏已有清单
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp_path = self.path.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+            self._unsaved = 0
+
+
+class BatchStats(object):
+    """
+    批量处理的统计信息快照
+    """
+
+    def __init__(self, queued, processing, processed, failed, elapsed, skipped=0, submitted=0):
+        self.queued = queued
+        self.processing = processing
+        self.processed = processed
+        self.failed = failed
+        self.elapsed = elapsed
+        self.skipped = skipped
+        self.submitted = submitted
+
+    def get_rate(self) -> float:
+        return self.processed / self.elapsed if self.elapsed > 0 else 0
+
+    def get_backlog(self, found: int) -> int:
+        """
+        尚未开始处理的图片数：队列中的图片加上已找到但还没有提交的图片，
+        队列长度有上限，只看 queued 无法反映剩余数量
+        :param found: 目前已找到的图片数
+        """
+        return self.queued + max(found - self.submitted, 0)
+
+
+class BatchRunner(object):
+    """
+    批量处理调度器：待处理图片放入有界队列，工作线程处理完一张后立即自行取下一张，
+    每张图片对应一个 Future，进度按固定的最小间隔主动推送
+    """
+    # 结束标记，每个工作线程取到后退出
+    _STOP = object()
+
+    def __init__(self, config: Config, output_dir, exif_map: dict | None = None, overrides: dict | None = None,
+                 on_result=None, on_progress=None, on_skip=None, progress_interval=0.1, input_dir=None):
+        """
+        :param config: 配置对象
+        :param output_dir: 输出目录
+        :param exif_map: 预读的 exif 信息
+        :param overrides: 进程池工作进程需要覆盖的设置，参见 apply_overrides
+        :param on_result: 每张图片完成后的回调 (图片路径, 输出路径, 异常)，在工作线程中调用
+        :param on_progress: 进度回调 (BatchStats)，两次调用至少间隔 progress_interval 秒
+        :param on_skip: 增量处理时跳过图片的回调 (图片路径, 输出路径)，在工作线程中调用
+        :param progress_interval: 进度推送的最小间隔，单位为秒
+        :param input_dir: 输入目录，指定时按图片相对输入目录的位置在输出目录中创建相同的子目录
+        """
+        self.config = config
+        self.output_dir = output_dir
+        self.input_dir = Path(input_dir) if input_dir is not None else None
+        self.exif_map = exif_map if exif_map is not None else {}
+        self.overrides = overrides
+        self.on_result = on_result
+        self.on_progress = on_progress
+        self.on_skip = on_skip
+        self.progress_interval = progress_interval
+        self.workers = config.get_workers()
+        self.memory_budget = MemoryBudget(get_task_memory_budget(config))
+
+        self._queue = queue.Queue(maxsize=self.workers * 2)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._threads = []
+        self._executor = None
+        self._processor_chain = None
+        self._manifest = Manifest(output_dir) if config.is_incremental() else None
+        self._signature = None
+        self._start_time = None
+        self._last_progress_time = 0
+
+        self.queued = 0
+        self.processing = 0
+        self.processed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.submitted = 0
+
+    def start(self) -> None:
+        """
+        启动工作线程；使用进程池时每个工作线程对应一个工作进程
+        """
+        # 输出尺寸的配置有误时在开始前报错，而不是每张图片都失败
+        Rendition.from_config(self.config)
+        # 进程池模式下主进程的处理器链只用于估算内存
+        self._processor_chain = build_processor_chain(self.config)
+        if self._manifest is not None:
+            self._signature = get_render_signature(self.config, self._processor_chain)
+        if self.config.get_executor_backend() == 'process':
+            self._executor = create_process_pool(self.workers, self.overrides)
+        self._start_time = time.time()
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, source_path: Path) -> Future:
+        """
+        提交一张图片，队列已满时阻塞直到有工作线程空闲
+        :param source_path: 图片路径
+        :return: Future，结果为输出路径
+        """
+        future = Future()
+        if self._stop_event.is_set():
+            future.cancel()
+            return future
+        with self._lock:
+            self.queued += 1
+            self.submitted += 1
+        self._queue.put((source_path, future))
+        return future
+
+    def run(self, paths) -> BatchStats:
+        """
+        处理一组图片，paths 可以是边扫描边生成的迭代器
+        :param paths: 图片路径
+        :return: 最终的统计信息
+        """
+        self.start()
+        try:
+            for path in paths:
+                if self._stop_event.is_set():
+                    break
+                self.submit(path)
+        finally:
+            self.shutdown()
+        return self.get_stats()
+
+    def iter_pending(self, paths):
+        """
+        增量处理时在提交之前跳过输出仍然有效的图片，放在 stream_with_exif 之前，跳过的图片不再预读 exif；
+        需要在 start() 之后迭代，直接传给 run() 即可
+        :param paths: 图片路径，可以是迭代器
+        :return: 生成需要处理的图片路径
+        """
+        if self._manifest is None:
+            yield from paths
+            return
+        for path in paths:
+            output = self._get_up_to_date_output(path)
+            if output is None:
+                yield path
+                continue
+            with self._lock:
+                # 跳过的图片不再等待提交，不计入 BatchStats.get_backlog
+                self.submitted += 1
+                self.skipped += 1
+            if self.on_skip is not None:
+                self.on_skip(path, output)
+            self._notify_progress()
+
+    def stop(self) -> None:
+        """
+        停止处理，正在处理的图片完成后退出，排队中的图片被取消
+        """
+        self._stop_event.set()
+
+    def is_stopped(self) -> bool:
+        return self._stop_event.is_set()
+
+    def shutdown(self) -> None:
+        """
+        等待已提交的图片全部完成并释放工作线程
+        """
+        for _ in self._threads:
+            self._queue.put(self._STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._manifest is not None:
+            self._manifest.save()
+        # 提交图片的线程在预读 exif 时也会创建 exiftool 进程
+        EXIFTOOL_POOL.release()
+        self._notify_progress(force=True)
+
+    def get_stats(self) -> BatchStats:
+        with self._lock:
+            return BatchStats(self.queued, self.processing, self.processed, self.failed,
+                              time.time() - self._start_time if self._start_time else 0, self.skipped,
+                              self.submitted)
+
+    def _work(self) -> None:
+        try:
+            self._work_loop()
+        finally:
+            # 每次处理都会创建新的工作线程，退出前关闭本线程的 exiftool 进程
+            EXIFTOOL_POOL.release()
+
+    def _work_loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                return
+            source_path, future = item
+            with self._lock:
+                self.queued -= 1
+                if self._stop_event.is_set():
+                    future.cancel()
+                    continue
+                self.processing += 1
+            future.set_running_or_notify_cancel()
+
+            # 跳过判断和内存估算也会读取文件，出错时与处理失败一样结束这张图片，工作线程继续
+            target_path, error, skipped = None, None, False
+            try:
+                target_path = self._get_up_to_date_output(source_path)
+                skipped = target_path is not None
+                if not skipped:
+                    target_path = self._render(source_path)
+            except Exception as e:
+                error = e
+                logger.error(f'处理文件 {source_path} 时出错: {e}', exc_info=True)
+
+            with self._lock:
+                self.processing -= 1
+                if skipped:
+                    self.skipped += 1
+                elif error is None:
+                    self.processed += 1
+                else:
+                    self.failed += 1
+            if skipped:
+                # 预读的 exif 只在处理时取出，跳过时也要丢弃，否则监视模式下会一直累积
+                self.exif_map.pop(source_path, None)
+                if self.on_skip is not None:
+                    self.on_skip(source_path, target_path)
+            elif self.on_result is not None:
+                self.on_result(source_path, target_path, error)
+            if error is None:
+                future.set_result(target_path)
+            else:
+                future.set_exception(error)
+            self._notify_progress()
+
+    def _render(self, source_path: Path) -> Path:
+        """
+        在内存预算内处理一张图片并记入增量处理清单
+        :return: 主输出路径
+        """
+        memory = self._estimate_memory(source_path)
+        self.memory_budget.acquire(memory)
+        try:
+            outputs = self._process(source_path)
+        finally:
+            self.memory_budget.release(memory)
+        if self._manifest is not None:
+            self._manifest.record(source_path, self._signature, outputs)
+        return outputs[0]
+
+    def _get_up_to_date_output(self, source_path: Path) -> Path | None:
+        if self._manifest is None:
+            return None
+        try:
+            return self._manifest.get_output(source_path, self._signature)
+        except OSError:
+            return None
+        except (KeyError, TypeError, ValueError) as e:
+            # 清单中的条目已损坏，重新处理后会被覆盖
+            logger.warning(f'增量处理清单中 {source_path} 的记录无效，重新处理: {e}')
+            return None
+
+    def _estimate_memory(self, source_path: Path) -> int:
+        if not self.memory_budget.max_bytes:
+            return 0
+        size = read_image_size(source_path)
+        if size is None:
+            return 0
+        return min(self._processor_chain.estimate_memory(*size), self.memory_budget.max_bytes)
+
+    def _get_output_dir(self, source_path: Path):
+        if self.input_dir is None:
+            return self.output_dir
+        try:
+            relative_dir = Path(source_path).parent.relative_to(self.input_dir)
+        except ValueError:
+            return self.output_dir
+        output_dir = Path(self.output_dir).joinpath(relative_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        return output_dir
+
+    def _process(self, source_path: Path) -> list[Path]:
+        exif = self.exif_map.pop(source_path, None)
+        output_dir = self._get_output_dir(source_path)
+        if self._executor is not None:
+            return submit_to_process_pool(self._executor, source_path, output_dir, exif).result()
+        return process_image(self.config, self._processor_chain, source_path, output_dir, exif)
+
+    def _notify_progress(self, force=False) -> None:
+        if self.on_progress is None:
+            return
+        with self._lock:
+            now = time.time()
+            if not force and now - self._last_progress_time < self.progress_interval:
+                return
+            self._last_progress_time = now
+        self.on_progress(self.get_stats())
@@ -0,0 +1,66 @@
+"""
+背景模糊性能测试：对比原尺寸模糊与缩小后模糊两种方式的耗时和画质（PSNR）
+
+用法：python benchmark_blur.py 照片1.jpg [照片2.jpg ...] [--downscale 2 4 8]
+"""
+import argparse
+import math
+import time
+from pathlib import Path
+
+from PIL import ImageChops
+from PIL import ImageStat
+
+from init import BACKGROUND_BLUR_PROCESSOR
+from init import BACKGROUND_BLUR_WITH_PARAMS_PROCESSOR
+from init import BACKGROUND_BLUR_WITH_WHITE_BORDER_PROCESSOR
+from init import config
+from core.entity.image_container import ImageContainer
+
+PROCESSORS = [
+    BACKGROUND_BLUR_PROCESSOR,
+    BACKGROUND_BLUR_WITH_WHITE_BORDER_PROCESSOR,
+    BACKGROUND_BLUR_WITH_PARAMS_PROCESSOR,
+]
+
+
+def psnr(a, b) -> float:
+    """
+    计算两张图片的峰值信噪比
+    """
+    rms = ImageStat.Stat(ImageChops.difference(a.convert('RGB'), b.convert('RGB'))).rms
+    mse = sum(v * v for v in rms) / len(rms)
+    return float('inf') if mse == 0 else 10 * math.log10(255 * 255 / mse)
+
+
+def render(processor, path, backend, downscale):
+    config.get_data()['global']['background_blur'] = {'backend': backend, 'downscale': downscale}
+    container = ImageContainer(path)
+    start = time.perf_counter()
+    processor.process(container)
+    elapsed = time.perf_counter() - start
+    return container.get_watermark_img(), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='背景模糊性能测试')
+    parser.add_argument('images', nargs='+', type=Path, help='测试照片')
+    parser.add_argument('--downscale', nargs='+', type=int, default=[2, 4, 8], help='缩小倍数')
+    args = parser.parse_args()
+
+    original = dict(config.get_data()['global'].get('background_blur', {}))
+    try:
+        for path in args.images:
+            for processor in PROCESSORS:
+                reference, full_time = render(processor, path, 'full', 1)
+                print(f'{path.name} {processor.LAYOUT_ID}: full {full_time * 1000:.0f} ms')
+                for downscale in args.downscale:
+                    result, fast_time = render(processor, path, 'fast', downscale)
+                    print(f'    downscale={downscale}: {fast_time * 1000:.0f} ms '
+                          f'({full_time / fast_time:.1f}x), PSNR {psnr(reference, result):.2f} dB')
+    finally:
+        config.get_data()['global']['background_blur'] = original
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+Semi-Utils - 命令行批量处理入口，不依赖 PyQt5，适合无显示器的渲染节点
+
+用法：python -m cli --input ./input --output ./output --layout watermark_left_logo --workers 8 --quality 90
+处理进度以 JSON Lines 格式逐行输出到标准输出
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+
+from batch import apply_overrides
+from batch import BatchRunner
+from core.entity.encoder import Rendition
+from init import config
+from init import layout_items_dict
+from utils import iter_image_files
+from utils import stream_with_exif
+from watch import FolderWatcher
+
+
+# 多个工作线程同时输出时保证每行完整
+_emit_lock = threading.Lock()
+
+
+def emit(event: str, **kwargs) -> None:
+    """
+    输出一行 JSON 格式的进度信息
+    """
+    line = json.dumps({'event': event, **kwargs}, ensure_ascii=False)
+    with _emit_lock:
+        print(line, flush=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m cli', description='Semi-Utils 命令行批量处理')
+    parser.add_argument('-i', '--input', default=config.get_input_dir(), help='输入目录，默认使用配置文件中的设置')
+    parser.add_argument('-o', '--output', default=config.get_data()['base']['output_dir'],
+                        help='输出目录，默认使用配置文件中的设置')
+    parser.add_argument('-l', '--layout', choices=sorted(layout_items_dict.keys()), help='布局类型')
+    parser.add_argument('-w', '--workers', type=int, help='并行数，默认为 CPU 核数')
+    parser.add_argument('-q', '--quality', type=int, help='图片质量（1-100）')
+    parser.add_argument('-f', '--format', type=str.upper, choices=['JPEG', 'WEBP', 'AVIF', 'PNG'],
+                        help='输出格式，默认与原图相同')
+    parser.add_argument('-b', '--backend', choices=['thread', 'process'], help='并行方式')
+    parser.add_argument('-r', '--recursive', action='store_true', default=None,
+                        help='处理子目录中的图片，输出目录中保持相同的目录结构')
+    parser.add_argument('--incremental', action='store_true', default=None,
+                        help='跳过输出目录中已是最新的图片')
+    parser.add_argument('-m', '--memory-budget', type=int, help='同时处理的图片占用内存的上限（MB），0 表示不限制')
+    parser.add_argument('--watch', action='store_true', help='持续监视输入目录，新照片写入完成后立即处理，Ctrl+C 退出')
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    overrides = {'layout': args.layout, 'quality': args.quality, 'output_format': args.format}
+    apply_overrides(config, **overrides)
+    executor = config.get_data()['base'].setdefault('executor', {})
+    if args.workers is not None:
+        executor['workers'] = args.workers
+    if args.backend is not None:
+        executor['backend'] = args.backend
+    if args.recursive is not None:
+        config.get_data()['base']['recursive'] = args.recursive
+    if args.incremental is not None:
+        config.get_data()['base']['incremental'] = args.incremental
+    if args.memory_budget is not None:
+        executor['memory_budget_mb'] = args.memory_budget
+
+    try:
+        Rendition.from_config(config)
+    except ValueError as e:
+        emit('error', error=str(e))
+        return 1
+
+    if not os.path.isdir(args.input):
+        emit('error', error=f'输入目录不存在: {args.input}')
+        return 1
+    os.makedirs(args.output, exist_ok=True)
+
+    if args.watch:
+        return watch(args, overrides)
+
+    emit('start', layout=config.get_layout_type(), recursive=config.is_recursive(),
+         backend=config.get_executor_backend(), workers=config.get_workers())
+    # 边扫描边处理，进度为已完成数占目前已找到的图片数的比例
+    found = 0
+
+    def scan():
+        nonlocal found
+        for path in iter_image_files(args.input, config.is_recursive(), exclude=args.output):
+            found += 1
+            yield path
+
+    def get_progress():
+        stats = runner.get_stats()
+        return (stats.processed + stats.failed + stats.skipped) / found
+
+    def on_result(source_path, target_path, error):
+        progress = get_progress()
+        if error is None:
+            emit('done', file=str(source_path), output=str(target_path), progress=progress)
+        else:
+            emit('error', file=str(source_path), error=str(error), progress=progress)
+
+    def on_skip(source_path, target_path):
+        emit('skip', file=str(source_path), output=str(target_path), progress=get_progress())
+
+    runner = BatchRunner(config, args.output, overrides=overrides, on_result=on_result, on_skip=on_skip,
+                         input_dir=args.input)
+    # 先按增量处理清单跳过已是最新的图片，再预读 exif
+    stats = runner.run(stream_with_exif(runner.iter_pending(scan()), runner.exif_map))
+    emit('finish', total=found, processed=stats.processed, failed=stats.failed, skipped=stats.skipped,
+         elapsed=round(stats.elapsed, 3), rate=round(stats.get_rate(), 3))
+    return 0 if stats.failed == 0 else 2
+
+
+def watch(args, overrides) -> int:
+    """
+    监视模式：逐张输出处理结果，直到收到 Ctrl+C
+    """
+    def on_result(source_path, target_path, error):
+        if error is None:
+            emit('done', file=str(source_path), output=str(target_path))
+        else:
+            emit('error', file=str(source_path), error=str(error))
+
+    def on_skip(source_path, target_path):
+        emit('skip', file=str(source_path), output=str(target_path))
+
+    runner = BatchRunner(config, args.output, overrides=overrides, on_result=on_result, on_skip=on_skip)
+    try:
+        watcher = FolderWatcher(runner, args.input, on_detect=lambda path: emit('detect', file=str(path)))
+    except ValueError as e:
+        emit('error', error=str(e))
+        return 1
+    emit('watch', input=args.input, layout=config.get_layout_type(),
+         backend=config.get_executor_backend(), workers=config.get_workers())
+    thread = threading.Thread(target=watcher.run, daemon=True)
+    thread.start()
+    try:
+        while thread.is_alive():
+            thread.join(0.5)
+    except KeyboardInterrupt:
+        watcher.stop()
+        thread.join()
+    stats = runner.get_stats()
+    emit('finish', processed=stats.processed, failed=stats.failed, skipped=stats.skipped,
+         elapsed=round(stats.elapsed, 3), rate=round(stats.get_rate(), 3))
+    return 0 if stats.failed == 0 else 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
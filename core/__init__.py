@@ -2,12 +2,16 @@
 核心模块 - 包含图像处理的核心逻辑
 """
 
+from .entity.encoder import Encoder
 from .entity.image_container import ImageContainer
 from .entity.image_processor import ProcessorChain, ProcessorComponent
+from .entity.render_context import RenderContext
 from .enums.constant import *
 
 __all__ = [
+    'Encoder',
     'ImageContainer',
     'ProcessorChain', 
-    'ProcessorComponent'
+    'ProcessorComponent',
+    'RenderContext'
 ]
\ No newline at end of file
@@ -1,4 +1,6 @@
+import logging
 import os
+import threading
 
 import yaml
 from PIL import Image
@@ -9,6 +11,9 @@ from ..enums.constant import LOCATION_LEFT_BOTTOM
 from ..enums.constant import LOCATION_LEFT_TOP
 from ..enums.constant import LOCATION_RIGHT_BOTTOM
 from ..enums.constant import LOCATION_RIGHT_TOP
+from ..enums.constant import TRANSPARENT
+
+logger = logging.getLogger(__name__)
 
 
 class ElementConfig(object):
@@ -40,6 +45,122 @@ FONT_SIZE = 240
 BOLD_FONT_SIZE = 260
 
 
+class FontRegistry(object):
+    """
+    字体缓存，按 (字体路径, 字号) 保存已加载的字体，所有工作线程共用
+    """
+
+    def __init__(self):
+        self._fonts = {}
+        self._lock = threading.Lock()
+        # 命中缓存而省去的 ImageFont.truetype 调用次数
+        self.saved_loads = 0
+
+    def get(self, path, size) -> ImageFont.FreeTypeFont:
+        """
+        获取字体，未加载过时才读取字体文件
+        :param path: 字体路径
+        :param size: 字号
+        :return: 字体对象
+        """
+        key = (path, size)
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is not None:
+                self.saved_loads += 1
+                return font
+            font = ImageFont.truetype(path, size)
+            self._fonts[key] = font
+            return font
+
+
+FONT_REGISTRY = FontRegistry()
+
+
+class LogoStore(object):
+    """
+    logo 缓存：启动时一次性解码所有厂商的 logo 并转换为 RGBA，
+    按需保存填充并缩放到水印条高度的版本；返回的图片由所有工作线程共享，只读
+    """
+
+    def __init__(self, makes: dict, default_path):
+        self._makes = makes
+        self._default_path = default_path
+        self._lock = threading.Lock()
+        # logo 路径 -> RGBA 图片
+        self._logos = {}
+        # 厂商字符串 -> logo 路径
+        self._paths = {}
+        # (logo 路径, 上下填充比例, 高度) -> 缩放后的图片
+        self._scaled_logos = {}
+        for path in [m['path'] for m in makes.values()] + [default_path]:
+            self._decode(path)
+
+    def _decode(self, path) -> Image.Image:
+        if path not in self._logos:
+            with Image.open(path) as logo:
+                self._logos[path] = logo.convert('RGBA')
+        return self._logos[path]
+
+    def resolve(self, make) -> str:
+        """
+        根据厂商获取 logo 路径，结果按厂商字符串缓存
+        :param make: 厂商
+        :return: logo 路径
+        """
+        with self._lock:
+            path = self._paths.get(make)
+        if path is not None:
+            return path
+        path = self._default_path
+        for m in self._makes.values():
+            if m['id'].lower() in make.lower():
+                path = m['path']
+                break
+        with self._lock:
+            self._paths[make] = path
+        return path
+
+    def get(self, make) -> Image.Image:
+        """
+        根据厂商获取 logo
+        :param make: 厂商
+        :return: logo
+        """
+        path = self.resolve(make)
+        with self._lock:
+            return self._decode(path)
+
+    def get_scaled(self, make, padding_ratio, height) -> Image.Image:
+        """
+        获取上下各填充 padding_ratio 倍透明像素后缩放到指定高度的 logo
+        :param make: 厂商
+        :param padding_ratio: 上下填充的比例
+        :param height: 指定高度
+        :return: logo
+        """
+        path = self.resolve(make)
+        key = (path, padding_ratio, height)
+        with self._lock:
+            scaled = self._scaled_logos.get(key)
+            if scaled is not None:
+                return scaled
+            logo = self._decode(path)
+            padding_size = int(padding_ratio * logo.height)
+            padded = Image.new('RGBA', (logo.width, logo.height + padding_size * 2), color=TRANSPARENT)
+            padded.paste(logo, (0, padding_size))
+            width = round(padded.width * height / padded.height)
+            scaled = padded.resize((width, height), Image.LANCZOS)
+            self._scaled_logos[key] = scaled
+            return scaled
+
+    def set_default_path(self, default_path) -> None:
+        with self._lock:
+            self._decode(default_path)
+            self._default_path = default_path
+            self._paths.clear()
+
+
 class Config(object):
     """
     配置对象
@@ -49,15 +170,12 @@ class Config(object):
         self._path = path
         with open(self._path, 'r', encoding='utf-8') as f:
             self._data = yaml.safe_load(f)
-        self._logos = {}
         self._left_top = ElementConfig(self._data['layout']['elements'][LOCATION_LEFT_TOP])
         self._left_bottom = ElementConfig(self._data['layout']['elements'][LOCATION_LEFT_BOTTOM])
         self._right_top = ElementConfig(self._data['layout']['elements'][LOCATION_RIGHT_TOP])
         self._right_bottom = ElementConfig(self._data['layout']['elements'][LOCATION_RIGHT_BOTTOM])
         self._makes = self._data['logo']['makes']
-        self.bg_color = self._data['layout']['background_color'] \
-            if 'background_color' in self._data['layout'] \
-            else '#ffffff'
+        self._logo_store = LogoStore(self._makes, self._data['logo']['default']['path'])
 
     def get(self, key):
         if key in self._data:
@@ -78,23 +196,19 @@ class Config(object):
         """
         根据厂商获取 logo
         :param make: 厂商
-        :return: logo
+        :return: logo，所有工作线程共享，不能修改或关闭
         """
-        # 已经读到内存中的 logo
-        if make in self._logos:
-            return self._logos[make]
-        # 未读取到内存中的 logo
-        for m in self._makes.values():
-            if m['id'] == '':
-                pass
-            if m['id'].lower() in make.lower():
-                logo = Image.open(m['path'])
-                self._logos[make] = logo
-                return logo
-        logo_path = self._data['logo']['default']['path']
-        logo = Image.open(logo_path)
-        self._logos[make] = logo
-        return logo
+        return self._logo_store.get(make)
+
+    def load_scaled_logo(self, make, padding_ratio, height) -> Image.Image:
+        """
+        根据厂商获取填充并缩放到指定高度的 logo
+        :param make: 厂商
+        :param padding_ratio: 上下填充的比例
+        :param height: 指定高度
+        :return: logo，所有工作线程共享，不能修改或关闭
+        """
+        return self._logo_store.get_scaled(make, padding_ratio, height)
 
     def get_data(self) -> dict:
         return self._data
@@ -115,17 +229,59 @@ class Config(object):
         """设置图片质量"""
         self._data['base']['quality'] = quality
 
+    def get_executor_backend(self) -> str:
+        """并行处理方式：thread（线程池）或 process（进程池）"""
+        return self._data['base'].get('executor', {}).get('backend', 'thread')
+
+    def get_workers(self) -> int:
+        """并行处理的工作线程或进程数，默认为 CPU 核数"""
+        workers = self._data['base'].get('executor', {}).get('workers')
+        return workers if workers else os.cpu_count() or 1
+
+    def get_memory_budget(self) -> int:
+        """同时处理的图片占用内存的上限，单位为字节，0 表示不限制"""
+        budget = self._data['base'].get('executor', {}).get('memory_budget_mb')
+        return int(budget) * 1024 * 1024 if budget else 0
+
+    def get_output_settings(self) -> dict:
+        """输出设置：格式、编码参数、色彩空间等"""
+        return self._data['base'].get('output') or {}
+
+    def set_output_format(self, fmt):
+        """设置输出格式，None 表示与原图相同"""
+        self._data['base'].setdefault('output', {})['format'] = fmt
+
+    def is_convert_to_srgb(self) -> bool:
+        """是否将带 ICC 配置文件的照片转换到 sRGB，否则原样保留配置文件"""
+        return bool(self.get_output_settings().get('convert_to_srgb', False))
+
+    def is_recursive(self) -> bool:
+        """是否处理输入目录的子目录，输出目录中保持相同的目录结构"""
+        return bool(self._data['base'].get('recursive', False))
+
+    def is_incremental(self) -> bool:
+        """是否跳过输出目录中已是最新的图片"""
+        return bool(self._data['base'].get('incremental', False))
+
+    def get_text_cache_size(self) -> int:
+        """文字图块缓存的大小上限，单位为字节"""
+        return int(self._data['base'].get('text_cache_mb', 128)) * 1024 * 1024
+
+    def get_strip_cache_size(self) -> int:
+        """水印条缓存的大小上限，单位为字节"""
+        return int(self._data['base'].get('strip_cache_mb', 256)) * 1024 * 1024
+
     def get_alternative_font(self):
-        return ImageFont.truetype(self._data['base']['alternative_font'], self.get_font_size())
+        return FONT_REGISTRY.get(self._data['base']['alternative_font'], self.get_font_size())
 
     def get_alternative_bold_font(self):
-        return ImageFont.truetype(self._data['base']['alternative_bold_font'], self.get_bold_font_size())
+        return FONT_REGISTRY.get(self._data['base']['alternative_bold_font'], self.get_bold_font_size())
 
     def get_font(self):
-        return ImageFont.truetype(self._data['base']['font'], self.get_font_size())
+        return FONT_REGISTRY.get(self._data['base']['font'], self.get_font_size())
 
     def get_bold_font(self):
-        return ImageFont.truetype(self._data['base']['bold_font'], self.get_bold_font_size())
+        return FONT_REGISTRY.get(self._data['base']['bold_font'], self.get_bold_font_size())
 
     def get_font_size(self):
         font_size = self._data['base']['font_size']
@@ -194,6 +350,15 @@ class Config(object):
     def use_equivalent_focal_length(self):
         return self._data['global']['focal_length']['use_equivalent_focal_length']
 
+    def get_blur_downscale(self) -> int:
+        """
+        背景模糊的缩小倍数，backend 为 full 时在原尺寸上模糊
+        """
+        blur = self._data['global'].get('background_blur', {})
+        if blur.get('backend', 'fast') == 'full':
+            return 1
+        return max(1, int(blur.get('downscale', 8)))
+
     def enable_padding_with_original_ratio(self):
         self._data['global']['padding_with_original_ratio']['enable'] = True
 
@@ -277,4 +442,5 @@ class Config(object):
 
     def set_default_logo_path(self, logo_path):
         self._data["logo"]['default']['path'] = logo_path
+        self._logo_store.set_default_path(logo_path)
         self.save()
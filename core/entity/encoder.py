@@ -0,0 +1,196 @@
+import io
+import logging
+from pathlib import Path
+
+from PIL import Image
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# 支持的输出格式及其后缀
+FORMAT_SUFFIXES = {
+    'JPEG': '.jpg',
+    'WEBP': '.webp',
+    'AVIF': '.avif',
+    'PNG': '.png',
+}
+# 有损格式才能通过调整质量控制文件大小
+LOSSY_FORMATS = ('JPEG', 'WEBP', 'AVIF')
+# 按文件大小搜索质量时的最低质量
+MIN_QUALITY = 30
+
+
+def is_format_supported(fmt) -> bool:
+    """
+    当前安装的 Pillow 是否支持保存该格式，例如 AVIF 需要 Pillow 11.2+ 或 pillow-avif-plugin
+    """
+    Image.init()
+    return fmt in Image.SAVE
+
+
+class Encoder(object):
+    """
+    图片编码器：按输出设置选择格式和编码参数，可以指定文件大小上限，此时在内存中按质量二分搜索后只写入一次
+    """
+
+    def __init__(self, fmt=None, quality=100, subsampling=None, progressive=False, optimize=False, max_bytes=None):
+        """
+        :param fmt: 输出格式 JPEG/WEBP/AVIF/PNG，None 表示与原图后缀相同
+        :param quality: 图片质量（1-100）
+        :param subsampling: 色度抽样，例如 4:4:4、4:2:2、4:2:0，None 表示使用 Pillow 的默认值
+        :param progressive: JPEG 是否使用渐进式编码
+        :param optimize: 是否优化编码（JPEG 优化哈夫曼表，WebP/AVIF 使用更慢的压缩，PNG 优化压缩）
+        :param max_bytes: 文件大小上限，单位为字节，None 表示不限制
+        """
+        fmt = fmt.upper() if fmt else None
+        if fmt == 'JPG':
+            fmt = 'JPEG'
+        if fmt is not None and (fmt not in FORMAT_SUFFIXES or not is_format_supported(fmt)):
+            logger.warning(f'不支持的输出格式 {fmt}，使用 JPEG')
+            fmt = 'JPEG'
+        self.format = fmt
+        self.quality = quality
+        self.subsampling = subsampling
+        self.progressive = progressive
+        self.optimize = optimize
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_config(cls, config: Config, spec: dict | None = None):
+        """
+        根据配置文件中的 base.output 创建编码器
+        :param config: 配置对象
+        :param spec: 覆盖 base.output 中的设置，例如某一输出尺寸的格式和质量
+        """
+        output = {**config.get_output_settings(), **(spec or {})}
+        return cls(fmt=output.get('format'),
+                   quality=output.get('quality') or config.get_quality(),
+                   subsampling=output.get('subsampling'),
+                   progressive=bool(output.get('progressive', False)),
+                   optimize=bool(output.get('optimize', False)),
+                   max_bytes=int(output['max_kb']) * 1024 if output.get('max_kb') else None)
+
+    def get_target_path(self, path) -> Path:
+        """
+        指定了输出格式时，按格式修改输出路径的后缀
+        """
+        path = Path(path)
+        if self.format is None:
+            return path
+        return path.with_suffix(FORMAT_SUFFIXES[self.format])
+
+    def get_format(self, target_path) -> str:
+        if self.format is not None:
+            return self.format
+        fmt = Image.registered_extensions().get(Path(target_path).suffix.lower(), 'JPEG')
+        return fmt if fmt in FORMAT_SUFFIXES else 'JPEG'
+
+    def get_params(self, fmt, quality) -> dict:
+        """
+        各格式的编码参数
+        """
+        if fmt == 'PNG':
+            return {'optimize': self.optimize}
+        params = {'quality': quality}
+        if fmt == 'JPEG':
+            params['progressive'] = self.progressive
+            params['optimize'] = self.optimize
+            if self.subsampling is not None:
+                params['subsampling'] = self.subsampling
+        elif fmt == 'WEBP':
+            params['method'] = 6 if self.optimize else 4
+        elif fmt == 'AVIF':
+            params['speed'] = 4 if self.optimize else 6
+            if self.subsampling is not None:
+                params['subsampling'] = self.subsampling
+        return params
+
+    def encode(self, image: Image.Image, target_path, **metadata) -> None:
+        """
+        编码并保存图片
+        :param image: 图片对象
+        :param target_path: 输出路径
+        :param metadata: exif、xmp、icc_profile 等随图片写入的信息
+        """
+        fmt = self.get_format(target_path)
+        if self.max_bytes is None or fmt not in LOSSY_FORMATS:
+            image.save(target_path, format=fmt, **self.get_params(fmt, self.quality), **metadata)
+            return
+
+        data = self._encode_to_bytes(image, fmt, self.quality, metadata)
+        if len(data) > self.max_bytes:
+            data = self._search_quality(image, fmt, metadata)
+        with open(target_path, 'wb') as f:
+            f.write(data)
+
+    def _encode_to_bytes(self, image: Image.Image, fmt, quality, metadata) -> bytes:
+        buffer = io.BytesIO()
+        image.save(buffer, format=fmt, **self.get_params(fmt, quality), **metadata)
+        return buffer.getvalue()
+
+    def _search_quality(self, image: Image.Image, fmt, metadata) -> bytes:
+        # 二分搜索不超过文件大小上限的最高质量
+        low, high = MIN_QUALITY, self.quality - 1
+        best = None
+        while low <= high:
+            quality = (low + high) // 2
+            data = self._encode_to_bytes(image, fmt, quality, metadata)
+            if len(data) <= self.max_bytes:
+                best = data
+                low = quality + 1
+            else:
+                high = quality - 1
+        if best is None:
+            logger.warning(f'质量降到 {MIN_QUALITY} 仍超过文件大小上限 {self.max_bytes} 字节')
+            best = self._encode_to_bytes(image, fmt, MIN_QUALITY, metadata)
+        return best
+
+
+class Rendition(object):
+    """
+    除主输出外额外生成的一种尺寸
+    """
+
+    def __init__(self, long_edge: int, encoder: Encoder, suffix: str):
+        """
+        :param long_edge: 长边像素数，图片本身更小时不放大
+        :param encoder: 编码器
+        :param suffix: 添加在文件名后的后缀
+        """
+        self.long_edge = long_edge
+        self.encoder = encoder
+        self.suffix = suffix
+
+    @classmethod
+    def from_config(cls, config: Config) -> list:
+        """
+        根据配置文件中的 base.output.renditions 创建输出尺寸列表，
+        每项可以设置 long_edge、format、quality、suffix，其余编码设置与 base.output 相同
+        :raise ValueError: 两种尺寸会写入同一个文件
+        """
+        renditions = []
+        for spec in config.get_output_settings().get('renditions') or []:
+            long_edge = int(spec['long_edge'])
+            rendition = cls(long_edge, Encoder.from_config(config, spec), spec.get('suffix') or f'_{long_edge}')
+            for other in renditions:
+                if rendition.conflicts_with(other):
+                    raise ValueError(f'base.output.renditions 中长边 {other.long_edge} 与 {long_edge} 的输出文件名相同，'
+                                     f'请设置不同的 suffix 或 format')
+            renditions.append(rendition)
+        return renditions
+
+    def conflicts_with(self, other) -> bool:
+        """
+        两种尺寸是否可能写入同一个文件
+        """
+        if self.suffix != other.suffix:
+            return False
+        if self.encoder.format is None or other.encoder.format is None:
+            # 与原图格式相同时沿用原图的后缀，支持处理的原图只有 JPEG 和 PNG
+            return (self.encoder.format or other.encoder.format) in (None, 'JPEG', 'PNG')
+        return self.encoder.format == other.encoder.format
+
+    def get_target_path(self, path) -> Path:
+        path = self.encoder.get_target_path(path)
+        return path.with_name(path.stem + self.suffix + path.suffix)
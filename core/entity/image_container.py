@@ -1,21 +1,29 @@
 import logging
 import os
 import re
+import struct
 from datetime import datetime
 from enum import Enum
 from pathlib import Path
 
 from PIL import Image
+from PIL.ExifTags import Base
+from PIL.ExifTags import GPS
+from PIL.ExifTags import IFD
 from PIL.Image import Transpose
 from dateutil import parser
 
 from .config import ElementConfig
+from .encoder import Encoder
+from .encoder import Rendition
 from ..enums.constant import *
 from utils import calculate_pixel_count
 from utils import extract_attribute
 from utils import extract_gps_info
 from utils import extract_gps_lat_and_long
 from utils import get_exif
+from utils import resize_image_with_long_edge
+from utils import SRGB_CONVERTER
 
 logger = logging.getLogger(__name__)
 
@@ -69,12 +77,232 @@ def get_focal_length(exif):
     return focal_length, focal_length_in_35mm_film
 
 
+# 与 exiftool 输出一致的方向描述
+ORIENTATION_DESCRIPTIONS = {
+    1: 'Horizontal (normal)',
+    2: 'Mirror horizontal',
+    3: 'Rotate 180',
+    4: 'Mirror vertical',
+    5: 'Mirror horizontal and rotate 270 CW',
+    6: 'Rotate 90 CW',
+    7: 'Mirror horizontal and rotate 90 CW',
+    8: 'Rotate 270 CW',
+}
+
+
+# 读取时已转为正向的方向，保存时方向标记重置为正常
+CORRECTED_ORIENTATIONS = ('Rotate 90 CW', 'Rotate 180', 'Rotate 270 CW')
+
+# TIFF 标签的数据类型
+TIFF_SHORT = 3
+TIFF_LONG = 4
+
+
+def _iter_ifd(tiff: bytearray, endian: str, offset: int):
+    """
+    遍历 IFD 中的条目
+    :return: 生成 (条目位置, 标签, 类型, 数量) 元组
+    """
+    count = struct.unpack_from(endian + 'H', tiff, offset)[0]
+    for i in range(count):
+        position = offset + 2 + i * 12
+        yield (position, *struct.unpack_from(endian + 'HHI', tiff, position))
+
+
+def _set_ifd_value(tiff: bytearray, endian: str, position: int, type_: int, count: int, value: int) -> None:
+    # 只修改直接保存在条目中的单个整数，SHORT 放不下时改为 LONG，条目大小不变
+    if count != 1 or type_ not in (TIFF_SHORT, TIFF_LONG):
+        return
+    if type_ == TIFF_SHORT and value <= 0xFFFF:
+        struct.pack_into(endian + 'HH', tiff, position + 8, value, 0)
+    else:
+        struct.pack_into(endian + 'HII', tiff, position + 2, TIFF_LONG, 1, value)
+
+
+def _patch_exif(data: bytes, reset_orientation: bool, width: int, height: int) -> bytes:
+    """
+    在原始 exif 数据中就地修改方向和尺寸，并断开缩略图（IFD1），其余数据的位置都不变：
+    MakerNote 等数据块中使用相对 TIFF 头的绝对偏移，重新生成 exif 会使它们失效
+    :param data: 原始 exif 数据
+    :param reset_orientation: 是否将方向标记重置为正常
+    :param width: 输出图片宽度
+    :param height: 输出图片高度
+    :return: 修改后的 exif 数据
+    :raise ValueError: exif 数据格式不正确
+    """
+    prefix = b'Exif\x00\x00' if data.startswith(b'Exif\x00\x00') else b''
+    tiff = bytearray(data[len(prefix):])
+    endian = {b'II': '<', b'MM': '>'}.get(bytes(tiff[:2]))
+    if endian is None:
+        raise ValueError('exif 数据不是 TIFF 格式')
+    try:
+        ifd0 = struct.unpack_from(endian + 'I', tiff, 4)[0]
+        exif_ifd = None
+        entry_count = 0
+        for position, tag, type_, count in _iter_ifd(tiff, endian, ifd0):
+            entry_count += 1
+            if tag == Base.Orientation and reset_orientation:
+                _set_ifd_value(tiff, endian, position, type_, count, 1)
+            elif tag == IFD.Exif:
+                exif_ifd = struct.unpack_from(endian + 'I', tiff, position + 8)[0]
+        # 缩略图与输出内容不符，将下一个 IFD 的偏移置零
+        struct.pack_into(endian + 'I', tiff, ifd0 + 2 + entry_count * 12, 0)
+        if exif_ifd:
+            for position, tag, type_, count in _iter_ifd(tiff, endian, exif_ifd):
+                if tag == Base.ExifImageWidth:
+                    _set_ifd_value(tiff, endian, position, type_, count, width)
+                elif tag == Base.ExifImageHeight:
+                    _set_ifd_value(tiff, endian, position, type_, count, height)
+    except struct.error as e:
+        raise ValueError(f'exif 数据已损坏: {e}') from e
+    return prefix + bytes(tiff)
+
+
+def _patch_xmp(xmp, reset_orientation: bool, width: int, height: int) -> bytes:
+    """
+    修改 XMP 中与 exif 对应的方向和尺寸，否则支持 XMP 的看图软件会再旋转一次；只修改已有的属性
+    :param xmp: 原始 XMP 数据
+    :param reset_orientation: 是否将方向重置为正常
+    :param width: 输出图片宽度
+    :param height: 输出图片高度
+    :return: 修改后的 XMP 数据
+    """
+    if isinstance(xmp, str):
+        xmp = xmp.encode('utf-8')
+    values = {
+        'tiff:ImageWidth': width,
+        'tiff:ImageLength': height,
+        'exif:PixelXDimension': width,
+        'exif:PixelYDimension': height,
+    }
+    if reset_orientation:
+        values['tiff:Orientation'] = 1
+    for name, value in values.items():
+        name = re.escape(name.encode('ascii'))
+        value = str(value).encode('ascii')
+        # 属性形式 tiff:Orientation="6" 与元素形式 <tiff:Orientation>6</tiff:Orientation>
+        xmp = re.sub(rb'(\b' + name + rb'\s*=\s*(["\']))[^"\']*(\2)', lambda m: m.group(1) + value + m.group(3), xmp)
+        xmp = re.sub(rb'(<' + name + rb'>)[^<]*(</' + name + rb'>)', lambda m: m.group(1) + value + m.group(2), xmp)
+    return xmp
+
+
+def _clean(value) -> str:
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', errors='ignore')
+    # 过滤非 ASCII 字符
+    return ''.join(c for c in str(value) if ord(c) < 128).strip('\x00 ')
+
+
+def _to_float(value) -> float | None:
+    if isinstance(value, tuple):
+        value = value[0] if value else None
+    try:
+        value = float(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    return value if value == value else None
+
+
+def _format_exposure_time(seconds: float) -> str:
+    if 0 < seconds < 0.25001:
+        return f'1/{int(0.5 + 1 / seconds)}'
+    value = f'{seconds:.1f}'
+    return value[:-2] if value.endswith('.0') else value
+
+
+def _format_gps_coordinate(dms, ref) -> str | None:
+    try:
+        degrees, minutes, seconds = (float(v) for v in dms)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    value = degrees + minutes / 60 + seconds / 3600
+    degrees = int(value)
+    minutes = int((value - degrees) * 60)
+    seconds = (value - degrees - minutes / 60) * 3600
+    return f'{degrees} deg {minutes}\' {seconds:.2f}" {_clean(ref)}'.strip()
+
+
+def read_native_exif(img: Image.Image) -> dict | None:
+    """
+    直接从 Pillow 已解析的 IFD0/ExifIFD/GPS 中读取常用 exif 信息，字段名和取值格式与 get_exif 一致
+    :param img: 图片对象
+    :return: exif信息，缺少必要字段（例如只存在于 MakerNote 中的镜头信息）时返回 None
+    """
+    if img.format != 'JPEG':
+        return None
+    exif = img.getexif()
+    exif_ifd = exif.get_ifd(IFD.Exif)
+    exif_dict = {}
+
+    for key, tag in (('Make', Base.Make), ('CameraModelName', Base.Model)):
+        if tag in exif and _clean(exif[tag]):
+            exif_dict[key] = _clean(exif[tag])
+    for key, tag in (('LensMake', Base.LensMake), ('LensModel', Base.LensModel)):
+        if tag in exif_ifd and _clean(exif_ifd[tag]):
+            exif_dict[key] = _clean(exif_ifd[tag])
+    # 镜头信息只能通过 exiftool 解析 MakerNote 获得
+    if 'Make' not in exif_dict or 'LensModel' not in exif_dict:
+        return None
+
+    if Base.Orientation in exif:
+        exif_dict['Orientation'] = ORIENTATION_DESCRIPTIONS.get(exif[Base.Orientation], str(exif[Base.Orientation]))
+
+    f_number = _to_float(exif_ifd.get(Base.FNumber))
+    if f_number:
+        exif_dict['FNumber'] = f'{f_number:.2f}' if f_number < 1 else f'{f_number:.1f}'
+    exposure_time = _to_float(exif_ifd.get(Base.ExposureTime))
+    if exposure_time:
+        exif_dict['ExposureTime'] = _format_exposure_time(exposure_time)
+    iso = _to_float(exif_ifd.get(Base.ISOSpeedRatings))
+    if iso:
+        exif_dict['ISO'] = str(int(iso))
+
+    focal_length = _to_float(exif_ifd.get(Base.FocalLength))
+    focal_length_35 = _to_float(exif_ifd.get(Base.FocalLengthIn35mmFilm))
+    if focal_length_35:
+        exif_dict['FocalLengthIn35mmFormat'] = f'{int(focal_length_35)} mm'
+    if focal_length:
+        # 与 exiftool 的复合标签 FocalLength35efl 保持一致
+        if focal_length_35:
+            exif_dict['FocalLength'] = f'{focal_length:.1f} mm (35 mm equivalent: {focal_length_35:.1f} mm)'
+        else:
+            exif_dict['FocalLength'] = f'{focal_length:.1f} mm'
+
+    date_time = _clean(exif_ifd.get(Base.DateTimeOriginal, ''))
+    if date_time:
+        date, _, time = date_time.partition(' ')
+        date_time = f'{date.replace(":", "-")} {time}'.strip()
+        sub_sec = _clean(exif_ifd.get(Base.SubsecTimeOriginal, ''))
+        if sub_sec.isdigit():
+            date_time += '.' + sub_sec[:3].ljust(3, '0')
+        date_time += _clean(exif_ifd.get(Base.OffsetTimeOriginal, '')).replace(':', '')
+        exif_dict['DateTimeOriginal'] = date_time
+
+    gps_ifd = exif.get_ifd(IFD.GPSInfo)
+    if GPS.GPSLatitude in gps_ifd and GPS.GPSLongitude in gps_ifd:
+        latitude = _format_gps_coordinate(gps_ifd[GPS.GPSLatitude], gps_ifd.get(GPS.GPSLatitudeRef, ''))
+        longitude = _format_gps_coordinate(gps_ifd[GPS.GPSLongitude], gps_ifd.get(GPS.GPSLongitudeRef, ''))
+        if latitude and longitude:
+            exif_dict['GPSLatitude'] = latitude
+            exif_dict['GPSLongitude'] = longitude
+            exif_dict['GPSPosition'] = f'{latitude}, {longitude}'
+
+    return exif_dict
+
+
 class ImageContainer(object):
-    def __init__(self, path: Path):
+    def __init__(self, path: Path, exif: dict | None = None):
         self.path: Path = path
         self.target_path: Path | None = None
         self.img: Image.Image = Image.open(path)
-        self.exif: dict = get_exif(path)
+        # 随图片保存的 ICC 配置文件
+        self.icc_profile: bytes | None = self.img.info.get('icc_profile') or None
+        # 转换到 sRGB 之前的配置文件，缩小图需要同样转换
+        self._source_icc_profile: bytes | None = None
+        # 优先使用批量预读的 exif 信息，其次直接解析常见 JPEG，最后才调用 exiftool
+        if exif is None:
+            exif = read_native_exif(self.img)
+        self.exif: dict = exif if exif is not None else get_exif(path)
         # 图像信息
         self.original_width = self.img.width
         self.original_height = self.img.height
@@ -97,23 +325,19 @@ class ImageContainer(object):
 
         # 修正图像方向
         self.orientation = self.exif[ExifId.ORIENTATION.value] if ExifId.ORIENTATION.value in self.exif else 1
-        if self.orientation == "Rotate 0":
-            pass
-        elif self.orientation == "Rotate 90 CW":
-            self.img = self.img.transpose(Transpose.ROTATE_270)
-        elif self.orientation == "Rotate 180":
-            self.img = self.img.transpose(Transpose.ROTATE_180)
-        elif self.orientation == "Rotate 270 CW":
-            self.img = self.img.transpose(Transpose.ROTATE_90)
-        else:
-            pass
+        self.img = self._correct_orientation(self.img)
+        # 按需解码的缩小图，键为缩小倍数
+        self._reduced_imgs = {}
 
         # 水印设置
         self.custom = '无'
         self.logo = None
+        # 处理器链中的渲染上下文，由第一个使用它的处理器创建
+        self.render_context = None
 
         # 水印图片
         self.watermark_img = None
+        self._watermark_img_modified = False
 
         self._param_dict[MODEL_VALUE] = self.model
         self._param_dict[PARAM_VALUE] = self.get_param_str()
@@ -163,6 +387,65 @@ class ImageContainer(object):
     def get_img(self):
         return self.img
 
+    def _correct_orientation(self, img: Image.Image) -> Image.Image:
+        if self.orientation == "Rotate 0":
+            pass
+        elif self.orientation == "Rotate 90 CW":
+            img = img.transpose(Transpose.ROTATE_270)
+        elif self.orientation == "Rotate 180":
+            img = img.transpose(Transpose.ROTATE_180)
+        elif self.orientation == "Rotate 270 CW":
+            img = img.transpose(Transpose.ROTATE_90)
+        else:
+            pass
+        return img
+
+    def get_reduced_img(self, scale: int) -> Image.Image:
+        """
+        获取缩小后的原图，JPEG 直接以 1/2、1/4、1/8 的比例从 DCT 解码，速度更快且占用内存更少
+        :param scale: 缩小倍数，返回图片的尺寸不小于原图的 1/scale
+        :return: 方向已修正的缩小图
+        """
+        if scale <= 1:
+            return self.img
+        if scale not in self._reduced_imgs:
+            img = Image.open(self.path)
+            size = (max(1, img.width // scale), max(1, img.height // scale))
+            img.draft(self.img.mode, size)
+            # 非 JPEG 格式不支持 draft，解码后再缩小
+            factor = min(img.width // size[0], img.height // size[1])
+            if factor > 1:
+                img = img.reduce(factor)
+            img = self._correct_orientation(img)
+            if self._source_icc_profile is not None:
+                img = SRGB_CONVERTER.convert(img, self._source_icc_profile) or img
+            self._reduced_imgs[scale] = img
+        return self._reduced_imgs[scale]
+
+    def convert_to_srgb(self) -> None:
+        """
+        将原图从其 ICC 配置文件转换到 sRGB，只需转换一次，之后的处理和保存都在 sRGB 中进行；
+        需要在处理器链开始之前调用
+        """
+        converted = SRGB_CONVERTER.convert(self.img, self.icc_profile)
+        if converted is None:
+            return
+        # 保留 exif、XMP 等信息
+        converted.info = dict(self.img.info)
+        self.img.close()
+        self.img = converted
+        self._source_icc_profile = self.icc_profile
+        self.icc_profile = SRGB_CONVERTER.get_srgb_profile()
+        for img in self._reduced_imgs.values():
+            img.close()
+        self._reduced_imgs.clear()
+
+    def is_watermark_img_modified(self) -> bool:
+        """
+        水印图片是否已被处理器修改，未修改时与原图内容相同
+        """
+        return self._watermark_img_modified
+
     def _parse_datetime(self) -> str:
         """
         解析日期，转换为指定的格式
@@ -220,6 +503,12 @@ class ImageContainer(object):
     def set_logo(self, logo) -> None:
         self.logo = logo
 
+    def get_render_context(self):
+        return self.render_context
+
+    def set_render_context(self, render_context) -> None:
+        self.render_context = render_context
+
     def is_use_equivalent_focal_length(self, flag: bool) -> None:
         self.use_equivalent_focal_length = flag
 
@@ -229,34 +518,86 @@ class ImageContainer(object):
         return self.watermark_img
 
     def update_watermark_img(self, watermark_img) -> None:
-        if self.watermark_img == watermark_img:
+        if self.watermark_img is watermark_img:
             return
         original_watermark_img = self.watermark_img
         self.watermark_img = watermark_img
+        self._watermark_img_modified = True
         if original_watermark_img is not None:
             original_watermark_img.close()
 
     def close(self):
         self.img.close()
         self.watermark_img.close()
+        for img in self._reduced_imgs.values():
+            img.close()
+        self._reduced_imgs.clear()
 
-    def save(self, target_path, quality=100):
-        if self.orientation == "Rotate 0":
-            pass
-        elif self.orientation == "Rotate 90 CW":
-            self.watermark_img = self.watermark_img.transpose(Transpose.ROTATE_90)
-        elif self.orientation == "Rotate 180":
-            self.watermark_img = self.watermark_img.transpose(Transpose.ROTATE_180)
-        elif self.orientation == "Rotate 270 CW":
-            self.watermark_img = self.watermark_img.transpose(Transpose.ROTATE_270)
-        else:
-            pass
+    def build_exif(self, width, height) -> bytes | None:
+        """
+        根据原图的 exif 生成输出图片的 exif：图片以正向保存，方向标记重置为正常，尺寸更新为输出尺寸，
+        缩略图与输出内容不符，不再保留
+        :param width: 输出图片宽度
+        :param height: 输出图片高度
+        :return: exif 数据，原图没有 exif 时返回 None
+        """
+        if 'exif' not in self.img.info:
+            return None
+        try:
+            return _patch_exif(self.img.info['exif'], self.orientation in CORRECTED_ORIENTATIONS, width, height)
+        except ValueError as e:
+            logger.warning(f'{self.path}: {e}，不保留 exif')
+            return None
 
+    def save(self, target_path, quality=100, encoder: Encoder | None = None):
+        """
+        保存处理后的图片
+        :param target_path: 输出路径
+        :param quality: 图片质量，未指定编码器时使用
+        :param encoder: 编码器，决定输出格式和编码参数
+        """
         if self.watermark_img.mode != 'RGB':
             self.watermark_img = self.watermark_img.convert('RGB')
 
-        if 'exif' in self.img.info:
-            self.watermark_img.save(target_path, quality=quality, encoding='utf-8',
-                                    exif=self.img.info['exif'] if 'exif' in self.img.info else '')
-        else:
-            self.watermark_img.save(target_path, quality=quality, encoding='utf-8')
+        if encoder is None:
+            encoder = Encoder(quality=quality)
+        encoder.encode(self.watermark_img, target_path,
+                       **self.get_metadata(self.watermark_img.width, self.watermark_img.height))
+
+    def save_renditions(self, target_path, renditions: list[Rendition]) -> list[Path]:
+        """
+        从内存中处理后的图片生成多种尺寸的输出，从大到小逐级缩小，原图只解码、渲染一次；需要在 save 之后调用
+        :param target_path: 主输出路径，各尺寸的输出路径在其基础上添加后缀
+        :param renditions: 输出尺寸列表
+        :return: 各尺寸的输出路径
+        """
+        paths = []
+        image = self.watermark_img
+        for rendition in sorted(renditions, key=lambda r: r.long_edge, reverse=True):
+            resized = resize_image_with_long_edge(image, rendition.long_edge, auto_close=False)
+            if image is not self.watermark_img and resized is not image:
+                image.close()
+            image = resized
+            path = rendition.get_target_path(target_path)
+            rendition.encoder.encode(image, path, **self.get_metadata(image.width, image.height))
+            paths.append(path)
+        if image is not self.watermark_img:
+            image.close()
+        return paths
+
+    def get_metadata(self, width, height) -> dict:
+        """
+        随图片一次写入的 exif、XMP 和 ICC 配置文件
+        :param width: 输出图片宽度
+        :param height: 输出图片高度
+        """
+        metadata = {}
+        exif = self.build_exif(width, height)
+        if exif is not None:
+            metadata['exif'] = exif
+        if self.img.info.get('xmp'):
+            metadata['xmp'] = _patch_xmp(self.img.info['xmp'], self.orientation in CORRECTED_ORIENTATIONS,
+                                         width, height)
+        if self.icc_profile is not None:
+            metadata['icc_profile'] = self.icc_profile
+        return metadata
@@ -6,18 +6,29 @@ from PIL import ImageOps
 
 from .config import Config
 from .image_container import ImageContainer
+from .render_context import RenderContext
+from ..enums.constant import CAMERA_MAKE_CAMERA_MODEL_VALUE
+from ..enums.constant import CAMERA_MODEL_LENS_MODEL_VALUE
+from ..enums.constant import CUSTOM_VALUE
 from ..enums.constant import GRAY
+from ..enums.constant import LENS_MAKE_LENS_MODEL_VALUE
+from ..enums.constant import LENS_VALUE
+from ..enums.constant import MAKE_VALUE
+from ..enums.constant import MODEL_VALUE
+from ..enums.constant import NONE_VALUE
 from ..enums.constant import TRANSPARENT
 from utils import append_image_by_side
+from utils import blur_image
 from utils import concatenate_image
+from utils import expand_image
 from utils import merge_images
 from utils import padding_image
 from utils import resize_image_with_height
 from utils import resize_image_with_width
-from utils import square_image
 from utils import text_to_image
-from utils import add_rounded_corners
-from utils import add_soft_shadow
+from utils import rounded_corner_mask
+from utils import soft_shadow_mask
+from utils import ImageCache
 
 printable = set(string.printable)
 
@@ -30,6 +41,12 @@ MIDDLE_VERTICAL_GAP = Image.new('RGBA', (20, 100), color=TRANSPARENT)
 LARGE_VERTICAL_GAP = Image.new('RGBA', (20, 200), color=TRANSPARENT)
 LINE_GRAY = Image.new('RGBA', (20, 1000), color=GRAY)
 LINE_TRANSPARENT = Image.new('RGBA', (20, 1000), color=TRANSPARENT)
+# 编译好的水印条，连拍等同一机身的照片只需渲染一次，大小上限由 base.strip_cache_mb 设置
+STRIP_CACHE = ImageCache(max_bytes=256 * 1024 * 1024)
+# 不随单张照片变化的文字，四个位置都是这些文字时水印条才会被缓存；
+# 拍摄时间、拍摄参数、文件名等每张照片都不同，缓存只会不断被替换
+STRIP_CACHEABLE_ELEMENTS = {MODEL_VALUE, MAKE_VALUE, LENS_VALUE, CUSTOM_VALUE, NONE_VALUE,
+                            LENS_MAKE_LENS_MODEL_VALUE, CAMERA_MODEL_LENS_MODEL_VALUE, CAMERA_MAKE_CAMERA_MODEL_VALUE}
 
 
 class ProcessorComponent:
@@ -38,6 +55,8 @@ class ProcessorComponent:
     """
     LAYOUT_ID = None
     LAYOUT_NAME = None
+    # 处理过程中同时存在的原图尺寸 RGBA 中间图片数量，用于估算内存占用
+    PEAK_BUFFERS = 2
 
     def __init__(self, config: Config):
         self.config = config
@@ -51,6 +70,41 @@ class ProcessorComponent:
     def add(self, component):
         raise NotImplementedError
 
+    def estimate_memory(self, width, height) -> int:
+        """
+        估算处理一张图片时中间图片占用的峰值内存
+        :param width: 图片宽度
+        :param height: 图片高度
+        :return: 字节数
+        """
+        return width * height * 4 * self.PEAK_BUFFERS
+
+    def get_signature(self) -> dict:
+        """
+        处理结果所依赖的设置，增量处理时用于判断已有的输出是否需要重新生成
+        """
+        return {'id': self.LAYOUT_ID}
+
+    def get_padding(self, container: ImageContainer, width, height):
+        """
+        只在图片四周填充纯色的处理器返回填充的大小和颜色，处理器链据此合并连续的填充
+        :param container: 图片对象
+        :param width: 填充前的图片宽度
+        :param height: 填充前的图片高度
+        :return: (左, 上, 右, 下, 颜色)，其他处理器返回 None
+        """
+        return None
+
+    def get_context(self, container: ImageContainer) -> RenderContext:
+        """
+        获取图片的渲染上下文，第一个使用它的处理器负责创建
+        """
+        context = container.get_render_context()
+        if context is None:
+            context = RenderContext(self.config)
+            container.set_render_context(context)
+        return context
+
 
 class ProcessorChain(ProcessorComponent):
     def __init__(self):
@@ -61,8 +115,34 @@ class ProcessorChain(ProcessorComponent):
         self.components.append(component)
 
     def process(self, container: ImageContainer) -> None:
+        # 连续的纯填充处理器只计算几何位置，最后一次性创建画布
+        paddings = []
+        width, height = container.get_width(), container.get_height()
         for component in self.components:
+            padding = component.get_padding(container, width, height)
+            if padding is not None:
+                paddings.append(padding)
+                left, top, right, bottom, _ = padding
+                width, height = width + left + right, height + top + bottom
+                continue
+            self._apply_paddings(container, paddings)
+            paddings = []
             component.process(container)
+            width, height = container.get_width(), container.get_height()
+        self._apply_paddings(container, paddings)
+
+    @staticmethod
+    def _apply_paddings(container: ImageContainer, paddings) -> None:
+        if paddings:
+            container.update_watermark_img(expand_image(container.get_watermark_img(), paddings))
+
+    def estimate_memory(self, width, height) -> int:
+        # 容器中的原图和 watermark_img 一直存在，各处理器的中间图片在处理器结束后释放
+        container_bytes = width * height * 4 * 2
+        return container_bytes + max((c.estimate_memory(width, height) for c in self.components), default=0)
+
+    def get_signature(self) -> dict:
+        return {'components': [c.get_signature() for c in self.components]}
 
 
 class EmptyProcessor(ProcessorComponent):
@@ -74,6 +154,7 @@ class EmptyProcessor(ProcessorComponent):
 
 class ShadowProcessor(ProcessorComponent):
     LAYOUT_ID = 'shadow'
+    PEAK_BUFFERS = 3
 
     def process(self, container: ImageContainer) -> None:
         # 加载图像
@@ -94,17 +175,34 @@ class ShadowProcessor(ProcessorComponent):
         container.update_watermark_img(shadow)
 
 
-class SquareProcessor(ProcessorComponent):
+class PaddingProcessor(ProcessorComponent):
+    """
+    只在图片四周填充纯色的处理器，由 get_padding 描述填充
+    """
+
+    def process(self, container: ImageContainer) -> None:
+        padding = self.get_padding(container, container.get_width(), container.get_height())
+        container.update_watermark_img(expand_image(container.get_watermark_img(), [padding]))
+
+    def get_padding(self, container: ImageContainer, width, height):
+        raise NotImplementedError
+
+
+class SquareProcessor(PaddingProcessor):
     LAYOUT_ID = 'square'
     LAYOUT_NAME = '1:1填充'
 
-    def process(self, container: ImageContainer) -> None:
-        image = container.get_watermark_img()
-        container.update_watermark_img(square_image(image, auto_close=False))
+    def get_padding(self, container: ImageContainer, width, height):
+        # 与 square_image 相同，两侧各填充差值的一半
+        delta = abs(width - height) // 2
+        if width < height:
+            return delta, 0, delta, 0, 'white'
+        return 0, delta, 0, delta, 'white'
 
 
 class WatermarkProcessor(ProcessorComponent):
     LAYOUT_ID = 'watermark'
+    PEAK_BUFFERS = 3
 
     def __init__(self, config: Config):
         super().__init__(config)
@@ -125,6 +223,35 @@ class WatermarkProcessor(ProcessorComponent):
     def is_logo_left(self):
         return self.logo_position == 'left'
 
+    def estimate_memory(self, width, height) -> int:
+        # 水印条按 NORMAL_HEIGHT 渲染，大小与照片尺寸无关，横构图时最宽
+        ratio = .04 + 0.02 * self.config.get_font_padding_level()
+        return super().estimate_memory(width, height) + int(NORMAL_HEIGHT / ratio) * NORMAL_HEIGHT * 4
+
+    def is_strip_cacheable(self) -> bool:
+        """
+        水印条的文字是否与具体照片无关
+        """
+        config = self.config
+        elements = [config.get_left_top(), config.get_left_bottom(), config.get_right_top(), config.get_right_bottom()]
+        return all(e.get_name() in STRIP_CACHEABLE_ELEMENTS for e in elements)
+
+    def get_signature(self) -> dict:
+        config = self.config
+        data = config.get_data()
+        elements = [config.get_left_top(), config.get_left_bottom(), config.get_right_top(), config.get_right_bottom()]
+        return {
+            'id': self.LAYOUT_ID,
+            # 自定义文字只影响显示它的位置
+            'elements': [[e.get_name(), e.get_value() if e.get_name() == CUSTOM_VALUE else None] for e in elements],
+            'colors': [self.font_color_lt, self.bold_font_lt, self.font_color_lb, self.bold_font_lb,
+                       self.font_color_rt, self.bold_font_rt, self.font_color_rb, self.bold_font_rb],
+            'logo': [self.logo_enable, self.logo_position, data['logo']] if self.logo_enable else False,
+            'bg_color': self.bg_color,
+            'fonts': [data['base']['font'], data['base']['bold_font'], config.get_font_size(),
+                      config.get_bold_font_size(), config.get_font_padding_level()],
+        }
+
     def process(self, container: ImageContainer) -> None:
         """
         生成一个默认布局的水印图片
@@ -132,7 +259,51 @@ class WatermarkProcessor(ProcessorComponent):
         :return: 添加水印后的图片对象
         """
         config = self.config
-        config.bg_color = self.bg_color
+        context = self.get_context(container)
+        # 后续的处理器（例如白边）使用与水印相同的背景色
+        context.bg_color = self.bg_color
+
+        texts = (container.get_attribute_str(config.get_left_top()),
+                 container.get_attribute_str(config.get_left_bottom()),
+                 container.get_attribute_str(config.get_right_top()),
+                 container.get_attribute_str(config.get_right_bottom()))
+        if self.is_strip_cacheable():
+            # 文字、logo 和横竖构图都相同时，水印条除最终缩放外完全一致
+            key = (id(self), texts, container.make, container.get_ratio() >= 1, config.get_font_padding_level(),
+                   config.get_data()['base']['font'], config.get_data()['base']['bold_font'],
+                   config.get_font_size(), config.get_bold_font_size())
+            strip = STRIP_CACHE.get(key, copy=False)
+            if strip is None:
+                strip = self.build_watermark(container, context, texts)
+                STRIP_CACHE.put(key, strip)
+            # 缩放水印的大小
+            watermark = resize_image_with_width(strip, container.get_width(), auto_close=False)
+        else:
+            watermark = resize_image_with_width(self.build_watermark(container, context, texts), container.get_width())
+        # 一次性创建最终的 RGB 画布，原图贴在上方，水印条按自身的透明度贴在下方
+        image = container.get_watermark_img()
+        result = Image.new('RGB', (image.width, image.height + watermark.height), color=self.bg_color)
+        if image.mode == 'RGB':
+            result.paste(image)
+        else:
+            rgb_image = image.convert('RGB')
+            result.paste(rgb_image)
+            rgb_image.close()
+        result.paste(watermark, (0, image.height), mask=watermark)
+        watermark.close()
+        # 更新图片对象
+        container.update_watermark_img(result)
+
+    def build_watermark(self, container: ImageContainer, context: RenderContext, texts) -> Image.Image:
+        """
+        生成未缩放的水印条
+        :param container: 图片对象
+        :param context: 渲染上下文
+        :param texts: 左上、左下、右上、右下的文字
+        :return: 高度为 NORMAL_HEIGHT 的水印条
+        """
+        config = self.config
+        left_top_text, left_bottom_text, right_top_text, right_bottom_text = texts
 
         # 下方水印的占比
         ratio = (.04 if container.get_ratio() >= 1 else .09) + 0.02 * config.get_font_padding_level()
@@ -144,26 +315,26 @@ class WatermarkProcessor(ProcessorComponent):
 
         with Image.new('RGBA', (10, 100), color=self.bg_color) as empty_padding:
             # 填充左边的文字内容
-            left_top = text_to_image(container.get_attribute_str(config.get_left_top()),
-                                     config.get_font(),
-                                     config.get_bold_font(),
+            left_top = text_to_image(left_top_text,
+                                     context.font,
+                                     context.bold_font,
                                      is_bold=self.bold_font_lt,
                                      fill=self.font_color_lt)
-            left_bottom = text_to_image(container.get_attribute_str(config.get_left_bottom()),
-                                        config.get_font(),
-                                        config.get_bold_font(),
+            left_bottom = text_to_image(left_bottom_text,
+                                        context.font,
+                                        context.bold_font,
                                         is_bold=self.bold_font_lb,
                                         fill=self.font_color_lb)
             left = concatenate_image([left_top, empty_padding, left_bottom])
             # 填充右边的文字内容
-            right_top = text_to_image(container.get_attribute_str(config.get_right_top()),
-                                      config.get_font(),
-                                      config.get_bold_font(),
+            right_top = text_to_image(right_top_text,
+                                      context.font,
+                                      context.bold_font,
                                       is_bold=self.bold_font_rt,
                                       fill=self.font_color_rt)
-            right_bottom = text_to_image(container.get_attribute_str(config.get_right_bottom()),
-                                         config.get_font(),
-                                         config.get_bold_font(),
+            right_bottom = text_to_image(right_bottom_text,
+                                         context.font,
+                                         context.bold_font,
                                          is_bold=self.bold_font_rb,
                                          fill=self.font_color_rb)
             right = concatenate_image([right_top, empty_padding, right_bottom])
@@ -174,19 +345,20 @@ class WatermarkProcessor(ProcessorComponent):
         right = padding_image(right, int(max_height * padding_ratio), 't')
         right = padding_image(right, left.height - right.height, 'b')
 
-        logo = config.load_logo(container.make)
+        context.logo = config.load_logo(container.make)
+        logo = context.logo
         if self.logo_enable:
             if self.is_logo_left():
                 # 如果 logo 在左边
                 line = LINE_TRANSPARENT.copy()
-                logo = padding_image(logo, int(padding_ratio * logo.height))
+                logo = config.load_scaled_logo(container.make, padding_ratio, watermark.height)
                 append_image_by_side(watermark, [line, logo, left], is_start=logo is None)
                 append_image_by_side(watermark, [right], side='right')
             else:
                 # 如果 logo 在右边
                 if logo is not None:
                     # 如果 logo 不为空，等比例缩小 logo
-                    logo = padding_image(logo, int(padding_ratio * logo.height))
+                    logo = config.load_scaled_logo(container.make, padding_ratio, watermark.height)
                     # 插入一根线条用于分割 logo 和文字
                     line = padding_image(LINE_GRAY, int(padding_ratio * LINE_GRAY.height * .8))
                 else:
@@ -199,19 +371,7 @@ class WatermarkProcessor(ProcessorComponent):
             append_image_by_side(watermark, [right], side='right')
         left.close()
         right.close()
-
-        # 缩放水印的大小
-        watermark = resize_image_with_width(watermark, container.get_width())
-        # 将水印图片放置在原始图片的下方
-        bg = ImageOps.expand(container.get_watermark_img().convert('RGBA'),
-                             border=(0, 0, 0, watermark.height),
-                             fill=self.bg_color)
-        fg = ImageOps.expand(watermark, border=(0, container.get_height(), 0, 0), fill=TRANSPARENT)
-        result = Image.alpha_composite(bg, fg)
-        watermark.close()
-        # 更新图片对象
-        result = ImageOps.exif_transpose(result).convert('RGB')
-        container.update_watermark_img(result)
+        return watermark
 
 
 class WatermarkRightLogoProcessor(WatermarkProcessor):
@@ -288,44 +448,52 @@ class CustomWatermarkProcessor(WatermarkProcessor):
         self.bold_font_rb = self.config.get_right_bottom().is_bold()
 
 
-class MarginProcessor(ProcessorComponent):
+class MarginProcessor(PaddingProcessor):
     LAYOUT_ID = 'margin'
 
-    def process(self, container: ImageContainer) -> None:
-        config = self.config
-        padding_size = int(config.get_white_margin_width() * min(container.get_width(), container.get_height()) / 100)
-        padding_img = padding_image(container.get_watermark_img(), padding_size, 'tlr', color=config.bg_color)
-        container.update_watermark_img(padding_img)
+    def get_signature(self) -> dict:
+        return {'id': self.LAYOUT_ID, 'width': self.config.get_white_margin_width(),
+                'bg_color': self.config.get_background_color()}
+
+    def get_padding(self, container: ImageContainer, width, height):
+        padding_size = int(self.config.get_white_margin_width() * min(width, height) / 100)
+        return padding_size, padding_size, padding_size, 0, self.get_context(container).bg_color
 
 
 class SimpleProcessor(ProcessorComponent):
     LAYOUT_ID = 'simple'
     LAYOUT_NAME = '简洁'
 
+    def get_signature(self) -> dict:
+        data = self.config.get_data()['base']
+        return {'id': self.LAYOUT_ID, 'fonts': [data['alternative_font'], data['alternative_bold_font'],
+                                                self.config.get_font_size(), self.config.get_bold_font_size()]}
+
     def process(self, container: ImageContainer) -> None:
+        context = self.get_context(container)
         ratio = .16 if container.get_ratio() >= 1 else .1
         padding_ratio = .5 if container.get_ratio() >= 1 else .5
 
         first_text = text_to_image('Shot on',
-                                   self.config.get_alternative_font(),
-                                   self.config.get_alternative_bold_font(),
+                                   context.alternative_font,
+                                   context.alternative_bold_font,
                                    is_bold=False,
                                    fill='#212121')
         model = text_to_image(container.get_model().replace(r'/', ' ').replace(r'_', ' '),
-                              self.config.get_alternative_font(),
-                              self.config.get_alternative_bold_font(),
+                              context.alternative_font,
+                              context.alternative_bold_font,
                               is_bold=True,
                               fill='#D32F2F')
         make = text_to_image(container.get_make().split(' ')[0],
-                             self.config.get_alternative_font(),
-                             self.config.get_alternative_bold_font(),
+                             context.alternative_font,
+                             context.alternative_bold_font,
                              is_bold=True,
                              fill='#212121')
         first_line = merge_images([first_text, MIDDLE_HORIZONTAL_GAP, model, MIDDLE_HORIZONTAL_GAP, make], 0, 1)
         second_line_text = container.get_param_str()
         second_line = text_to_image(second_line_text,
-                                    self.config.get_alternative_font(),
-                                    self.config.get_alternative_bold_font(),
+                                    context.alternative_font,
+                                    context.alternative_bold_font,
                                     is_bold=False,
                                     fill='#9E9E9E')
         image = merge_images([first_line, MIDDLE_VERTICAL_GAP, second_line], 1, 0)
@@ -342,38 +510,64 @@ class SimpleProcessor(ProcessorComponent):
         container.update_watermark_img(watermark_img)
 
 
-class PaddingToOriginalRatioProcessor(ProcessorComponent):
+class PaddingToOriginalRatioProcessor(PaddingProcessor):
     LAYOUT_ID = 'padding_to_original_ratio'
 
-    def process(self, container: ImageContainer) -> None:
+    def get_padding(self, container: ImageContainer, width, height):
         original_ratio = container.get_original_ratio()
         ratio = container.get_ratio()
         if original_ratio > ratio:
             # 如果原始比例大于当前比例，说明宽度大于高度，需要填充高度
-            padding_size = int(container.get_width() / original_ratio - container.get_height())
-            padding_img = ImageOps.expand(container.get_watermark_img(), (0, padding_size), fill='white')
+            padding_size = int(width / original_ratio - height)
+            return 0, padding_size, 0, padding_size, 'white'
         else:
             # 如果原始比例小于当前比例，说明高度大于宽度，需要填充宽度
-            padding_size = int(container.get_height() * original_ratio - container.get_width())
-            padding_img = ImageOps.expand(container.get_watermark_img(), (padding_size, 0), fill='white')
-        container.update_watermark_img(padding_img)
+            padding_size = int(height * original_ratio - width)
+            return padding_size, 0, padding_size, 0, 'white'
 
 
 PADDING_PERCENT_IN_BACKGROUND = 0.18
 GAUSSIAN_KERNEL_RADIUS = 75
 
 
+def blur_background(container: ImageContainer, size, downscale, blur_first=True, use_original=False) -> Image.Image:
+    """
+    生成模糊背景，缩小模糊且处理器尚未修改图片时，直接使用解码阶段缩小的原图
+    :param container: 图片对象
+    :param size: 背景尺寸
+    :param downscale: 缩小倍数
+    :param blur_first: 模糊半径是否按原图尺寸计算
+    :param use_original: 是否总是使用原图而不是水印图片
+    :return: 模糊后的背景
+    """
+    radius = GAUSSIAN_KERNEL_RADIUS
+    if use_original or not container.is_watermark_img_modified():
+        source = container.get_img()
+        if downscale > 1:
+            reduced = container.get_reduced_img(int(source.width * downscale / size[0]))
+            if blur_first:
+                radius = radius * reduced.width / source.width
+            source = reduced
+    else:
+        source = container.get_watermark_img()
+    return blur_image(source, radius, size=size, downscale=downscale, blur_first=blur_first)
+
+
 class BackgroundBlurProcessor(ProcessorComponent):
     LAYOUT_ID = 'background_blur'
     LAYOUT_NAME = '背景模糊'
+    PEAK_BUFFERS = 3
+
+    def get_signature(self) -> dict:
+        return {'id': self.LAYOUT_ID, 'downscale': self.config.get_blur_downscale()}
 
     def process(self, container: ImageContainer) -> None:
-        background = container.get_watermark_img()
-        background = background.filter(ImageFilter.GaussianBlur(radius=GAUSSIAN_KERNEL_RADIUS))
+        background = blur_background(container,
+                                     (int(container.get_width() * (1 + PADDING_PERCENT_IN_BACKGROUND)),
+                                      int(container.get_height() * (1 + PADDING_PERCENT_IN_BACKGROUND))),
+                                     self.config.get_blur_downscale())
         fg = Image.new('RGB', background.size, color=(255, 255, 255))
         background = Image.blend(background, fg, 0.1)
-        background = background.resize((int(container.get_width() * (1 + PADDING_PERCENT_IN_BACKGROUND)),
-                                        int(container.get_height() * (1 + PADDING_PERCENT_IN_BACKGROUND))))
         background.paste(container.get_watermark_img(),
                          (int(container.get_width() * PADDING_PERCENT_IN_BACKGROUND / 2),
                           int(container.get_height() * PADDING_PERCENT_IN_BACKGROUND / 2)))
@@ -383,16 +577,22 @@ class BackgroundBlurProcessor(ProcessorComponent):
 class BackgroundBlurWithWhiteBorderProcessor(ProcessorComponent):
     LAYOUT_ID = 'background_blur_with_white_border'
     LAYOUT_NAME = '背景模糊+白框'
+    PEAK_BUFFERS = 4
+
+    def get_signature(self) -> dict:
+        return {'id': self.LAYOUT_ID, 'downscale': self.config.get_blur_downscale(),
+                'width': self.config.get_white_margin_width()}
 
     def process(self, container: ImageContainer) -> None:
         padding_size = int(
             self.config.get_white_margin_width() * min(container.get_width(), container.get_height()) / 256)
         padding_img = padding_image(container.get_watermark_img(), padding_size, 'tblr', color='white')
 
-        background = container.get_img()
-        background = background.filter(ImageFilter.GaussianBlur(radius=GAUSSIAN_KERNEL_RADIUS))
-        background = background.resize((int(padding_img.width * (1 + PADDING_PERCENT_IN_BACKGROUND)),
-                                        int(padding_img.height * (1 + PADDING_PERCENT_IN_BACKGROUND))))
+        background = blur_background(container,
+                                     (int(padding_img.width * (1 + PADDING_PERCENT_IN_BACKGROUND)),
+                                      int(padding_img.height * (1 + PADDING_PERCENT_IN_BACKGROUND))),
+                                     self.config.get_blur_downscale(),
+                                     use_original=True)
         fg = Image.new('RGB', background.size, color=(255, 255, 255))
         background = Image.blend(background, fg, 0.1)
         background.paste(padding_img, (int(padding_img.width * PADDING_PERCENT_IN_BACKGROUND / 2),
@@ -400,20 +600,29 @@ class BackgroundBlurWithWhiteBorderProcessor(ProcessorComponent):
         container.update_watermark_img(background)
 
 
-class PureWhiteMarginProcessor(ProcessorComponent):
+class PureWhiteMarginProcessor(PaddingProcessor):
     LAYOUT_ID = 'pure_white_margin'
     LAYOUT_NAME = '白色边框'
 
-    def process(self, container: ImageContainer) -> None:
-        config = self.config
-        padding_size = int(config.get_white_margin_width() * min(container.get_width(), container.get_height()) / 100)
-        padding_img = padding_image(container.get_watermark_img(), padding_size, 'tlrb', color=config.bg_color)
-        container.update_watermark_img(padding_img)
+    def get_signature(self) -> dict:
+        return {'id': self.LAYOUT_ID, 'width': self.config.get_white_margin_width(),
+                'bg_color': self.config.get_background_color()}
+
+    def get_padding(self, container: ImageContainer, width, height):
+        padding_size = int(self.config.get_white_margin_width() * min(width, height) / 100)
+        return padding_size, padding_size, padding_size, padding_size, self.get_context(container).bg_color
 
 
 class BackgroundBlurWithParamsProcessor(ProcessorComponent):
     LAYOUT_ID = 'background_blur_with_params'
     LAYOUT_NAME = '背景模糊+参数'
+    PEAK_BUFFERS = 5
+
+    def get_signature(self) -> dict:
+        data = self.config.get_data()['base']
+        return {'id': self.LAYOUT_ID, 'downscale': self.config.get_blur_downscale(),
+                'fonts': [data['font'], data['bold_font'], self.config.get_font_size(),
+                          self.config.get_bold_font_size()]}
 
     def process(self, container: ImageContainer) -> None:
         # 计算参数区域高度（约为原图高度的8%）
@@ -427,30 +636,30 @@ class BackgroundBlurWithParamsProcessor(ProcessorComponent):
         bottom_padding = total_padding_height - top_padding
         
         # 创建一体化背景模糊图像（包含整个区域）
-        # 先创建一个放大的原图作为基础
-        enlarged_img = container.get_watermark_img().resize((final_width, final_height), Image.LANCZOS)
-        
-        # 对整个区域应用模糊效果
-        background = enlarged_img.filter(ImageFilter.GaussianBlur(radius=GAUSSIAN_KERNEL_RADIUS))
+        # 将原图放大到整个区域后应用模糊效果
+        background = blur_background(container, (final_width, final_height),
+                                     self.config.get_blur_downscale(),
+                                     blur_first=False)
         fg = Image.new('RGB', background.size, color=(255, 255, 255))
         background = Image.blend(background, fg, 0.1)
         
         # 获取相机名称和参数文本
+        context = self.get_context(container)
         model_text = container.get_model()
         param_text = container.get_param_str()
         
         # 创建文本图像（相机名称和参数文本）
         # 相机名称使用粗体，灰白色
         model_image = text_to_image(model_text,
-                                    self.config.get_font(),
-                                    self.config.get_bold_font(),
+                                    context.font,
+                                    context.bold_font,
                                     is_bold=True,
                                     fill='#F5F5F5')  # 接近纯白的灰白色
         
         # 参数文本使用常规字重，灰白色
         param_image = text_to_image(param_text,
-                                    self.config.get_font(),
-                                    self.config.get_bold_font(),
+                                    context.font,
+                                    context.bold_font,
                                     is_bold=False,
                                     fill='#F5F5F5')  # 接近纯白的灰白色
         
@@ -501,13 +710,15 @@ class BackgroundBlurWithParamsProcessor(ProcessorComponent):
         # 放置原图（在背景模糊图像上方，上移）
         original_img = container.get_watermark_img()
         
-        # 为原图添加圆角效果，圆角半径设置为原图宽度的1%
+        # 为原图添加圆角效果，圆角半径设置为原图宽度的1%，只生成单通道蒙版，原图保持 RGB
         rounded_radius = int(container.get_width() * 0.01)
-        rounded_img = add_rounded_corners(original_img, rounded_radius)
+        rounded_mask = rounded_corner_mask(original_img.size, rounded_radius)
+        if original_img.mode != 'RGB':
+            original_img = original_img.convert('RGB')
         
         # 为圆角后的原图添加柔滑的黑色阴影效果
         # 阴影参数：模糊半径为50，不透明度为128
-        shadow_img = add_soft_shadow(rounded_img, radius=50, opacity=256)
+        shadow_mask = soft_shadow_mask(original_img.size, radius=50, opacity=256)
         
         # 计算添加阴影后的原图位置
         # 阴影边缘留出足够空间，确保阴影效果完整显示
@@ -515,16 +726,17 @@ class BackgroundBlurWithParamsProcessor(ProcessorComponent):
         original_x = int(container.get_width() * PADDING_PERCENT_IN_BACKGROUND / 2) - shadow_margin
         original_y = int(container.get_height() * PADDING_PERCENT_IN_BACKGROUND / 2) - top_padding - shadow_margin
         
-        # 将带阴影的图片粘贴到背景上
-        background.paste(shadow_img, (original_x, original_y), shadow_img)
+        # 按阴影蒙版在背景上贴黑色，再按圆角蒙版贴上原图
+        background.paste((0, 0, 0), (original_x, original_y,
+                                     original_x + shadow_mask.width, original_y + shadow_mask.height), shadow_mask)
+        background.paste(original_img, (original_x + shadow_margin, original_y + shadow_margin), rounded_mask)
         
         # 清理资源
         model_image.close()
         param_image.close()
         original_img.close()
-        rounded_img.close()
-        shadow_img.close()
-        enlarged_img.close()
+        rounded_mask.close()
+        shadow_mask.close()
         fg.close()
         
         container.update_watermark_img(background)
@@ -0,0 +1,19 @@
+from PIL import Image
+from PIL import ImageFont
+
+from .config import Config
+
+
+class RenderContext(object):
+    """
+    单张图片在处理器链中的渲染上下文
+    保存背景色、字体、logo 等处理过程中派生的状态，处理器之间通过它传递，而不是修改共享的 Config
+    """
+
+    def __init__(self, config: Config):
+        self.bg_color: str = config.get_background_color()
+        self.font: ImageFont.FreeTypeFont = config.get_font()
+        self.bold_font: ImageFont.FreeTypeFont = config.get_bold_font()
+        self.alternative_font: ImageFont.FreeTypeFont = config.get_alternative_font()
+        self.alternative_bold_font: ImageFont.FreeTypeFont = config.get_alternative_bold_font()
+        self.logo: Image.Image | None = None
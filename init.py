@@ -18,11 +18,13 @@ from core.entity.image_processor import PureWhiteMarginProcessor
 from core.entity.image_processor import ShadowProcessor
 from core.entity.image_processor import SimpleProcessor
 from core.entity.image_processor import SquareProcessor
+from core.entity.image_processor import STRIP_CACHE
 from core.entity.image_processor import WatermarkLeftLogoProcessor
 from core.entity.image_processor import WatermarkProcessor
 from core.entity.image_processor import WatermarkRightLogoProcessor
 from core.entity.menu import *
 from core.enums.constant import *
+from utils import TEXT_TILE_CACHE
 
 # 如果 logs 不存在，创建 logs
 Path('./logs').mkdir(parents=True, exist_ok=True)
@@ -76,6 +78,8 @@ class LayoutItem(object):
 
 # 读取配置
 config = Config('config.yaml')
+TEXT_TILE_CACHE.set_max_bytes(config.get_text_cache_size())
+STRIP_CACHE.set_max_bytes(config.get_strip_cache_size())
 
 EMPTY_PROCESSOR = EmptyProcessor(config)
 WATERMARK_PROCESSOR = WatermarkProcessor(config)
@@ -7,11 +7,8 @@ import os
 import sys
 import logging
 import traceback
-import time
-import queue
-from pathlib import Path
 
-from PyQt5.QtCore import QThread, QThreadPool, QRunnable, QObject, pyqtSignal, pyqtSlot, Qt
+from PyQt5.QtCore import QThread, pyqtSignal, Qt
 from PyQt5.QtGui import QPixmap
 from PyQt5.QtWidgets import (QApplication, QVBoxLayout, QHBoxLayout, 
                              QWidget, QGroupBox, QFormLayout, QTextEdit,
@@ -23,70 +20,13 @@ from qfluentwidgets import (FluentWindow, setTheme, Theme, setThemeColor,
                            SpinBox, ProgressBar, TitleLabel, BodyLabel,
                            MessageBox, FluentIcon)
 
+from batch import BatchRunner
 from core.entity.config import Config
-from core.entity.image_processor import ProcessorChain
 from core.enums.constant import *
-from init import (WATERMARK_PROCESSOR, WATERMARK_LEFT_LOGO_PROCESSOR,
-                   WATERMARK_RIGHT_LOGO_PROCESSOR, MARGIN_PROCESSOR, SHADOW_PROCESSOR,
-                   SQUARE_PROCESSOR, SIMPLE_PROCESSOR, PADDING_TO_ORIGINAL_RATIO_PROCESSOR,
-                   config, layout_items_dict)
+from init import config, layout_items_dict
 from utils import get_file_list
 
 
-class ImageWorker(QRunnable):
-    """图片处理工作线程"""
-    def __init__(self, config, source_path, output_dir, processor_chain):
-        super().__init__()
-        self.config = config
-        self.source_path = source_path
-        self.output_dir = output_dir
-        self.processor_chain = processor_chain
-        # 创建信号对象并设置线程亲和性
-        self.signals = WorkerSignals()
-        # 确保信号对象在主线程中创建和管理
-        self.signals.moveToThread(QApplication.instance().thread())
-        # 设置AutoDelete为False，确保信号发送完成后再删除
-        self.setAutoDelete(False)
-    
-    @pyqtSlot()
-    def run(self):
-        """处理单个图片"""
-        try:
-            from core.entity.image_container import ImageContainer
-            from utils import ENCODING
-            
-            # 发送开始信号
-            self.signals.started.emit(self.source_path)
-            
-            # 创建并处理图片容器
-            container = ImageContainer(self.source_path)
-            container.is_use_equivalent_focal_length(self.config.use_equivalent_focal_length())
-            
-            # 应用处理器链
-            self.processor_chain.process(container)
-            
-            # 保存处理后的图片
-            target_path = Path(self.output_dir).joinpath(self.source_path.name)
-            container.save(target_path, quality=self.config.get_quality())
-            container.close()
-            
-            # 发送完成信号
-            self.signals.finished.emit(self.source_path)
-        except Exception as e:
-            error_msg = f"处理文件 {self.source_path.name} 时出错: {str(e)}"
-            self.signals.error.emit(error_msg)
-
-
-class WorkerSignals(QObject):
-    """工作线程信号类"""
-    started = pyqtSignal(object)  # 开始处理信号，传递文件路径
-    finished = pyqtSignal(object)  # 完成处理信号，传递文件路径
-    error = pyqtSignal(str)  # 错误信号，传递错误信息
-    
-    def __init__(self, parent=None):
-        super().__init__(parent)
-
-
 class ProcessingThread(QThread):
     """图片处理线程"""
     progress_updated = pyqtSignal(int)
@@ -99,91 +39,35 @@ class ProcessingThread(QThread):
         self.config = config
         self.input_dir = input_dir
         self.output_dir = output_dir
-        self.processor_chain = ProcessorChain()
-        self.stop_event = False
-        self.thread_pool = QThreadPool()
-        self.thread_pool.setMaxThreadCount(5)  # 设置最大线程数为5
-        self.file_queue = queue.Queue()
+        self.runner = None
+        self.total_files = 0
     
     def run(self):
         """运行处理线程
         
-        使用线程池并行处理图片，并更新进度和统计信息。
+        由 BatchRunner 调度：工作线程处理完一张后立即取下一张，进度按固定间隔推送到界面。
         """
         try:
-            from utils import get_file_list
-            
-            file_list = get_file_list(self.input_dir)
-            total_files = len(file_list)
-            
-            if total_files == 0:
-                self.processing_finished.emit()
-                return
+            from utils import stream_with_exif
             
-            # 构建处理器链
-            layout_type = self.config.get_layout_type()
-            if self.config.has_shadow_enabled() and layout_type and 'square' != layout_type:
-                self.processor_chain.add(SHADOW_PROCESSOR)
-            
-            if layout_type and layout_type in layout_items_dict:
-                self.processor_chain.add(layout_items_dict.get(layout_type).processor)
-            else:
-                self.processor_chain.add(SIMPLE_PROCESSOR)
-            
-            if self.config.has_white_margin_enabled() and layout_type and 'watermark' in layout_type:
-                self.processor_chain.add(MARGIN_PROCESSOR)
-            
-            if self.config.has_padding_with_original_ratio_enabled() and layout_type and 'square' != layout_type:
-                self.processor_chain.add(PADDING_TO_ORIGINAL_RATIO_PROCESSOR)
-            
-            # 初始化统计信息和变量
-            self.queued = total_files
-            self.processing = 0
-            self.processed = 0
-            self.failed = 0
-            self.active_workers = {}  # 跟踪活跃的工作线程
-            self.start_time = time.time()
-            
-            # 将所有文件放入队列
-            for file_path in file_list:
-                self.file_queue.put(file_path)
-            
-            # 连接信号槽
-            self.thread_pool.waitForDone()  # 确保线程池为空
-            
-            # 启动初始工作线程
-            for _ in range(min(5, self.queued)):
-                if not self.file_queue.empty():
-                    self._start_next_worker()
-            
-            # 定期更新统计信息
-            while self.processing > 0 or not self.file_queue.empty():
-                if self.stop_event:
-                    break
-                
-                # 更新统计信息
-                elapsed_time = time.time() - self.start_time
-                rate = self.processed / elapsed_time if elapsed_time > 0 else 0
-                self.stats_updated.emit(self.queued, self.processing, self.processed, rate)
-                
-                # 更新进度条
-                progress = int(((self.processed + self.failed) / total_files) * 100)
-                self.progress_updated.emit(progress)
-                
-                # 短暂休眠避免CPU占用过高
-                time.sleep(0.1)
-            
-            # 等待所有线程完成
-            self.thread_pool.waitForDone()
+            self.runner = BatchRunner(self.config, self.output_dir,
+                                      on_result=self._on_result,
+                                      on_progress=self._on_progress,
+                                      input_dir=self.input_dir)
+            # 边扫描边处理，逐批预读 exif 信息，避免每张照片单独调用 exiftool
+            # 先按增量处理清单跳过已是最新的图片，再预读 exif
+            stats = self.runner.run(stream_with_exif(self.runner.iter_pending(self._scan()), self.runner.exif_map))
             
             # 发送最终进度和统计信息
-            self.progress_updated.emit(100 if self.processed + self.failed == total_files else 0)
-            elapsed_time = time.time() - self.start_time
-            rate = self.processed / elapsed_time if elapsed_time > 0 else 0
-            self.stats_updated.emit(0, 0, self.processed, rate)
+            self.progress_updated.emit(
+                100 if stats.processed + stats.failed + stats.skipped == self.total_files else 0)
+            self.stats_updated.emit(0, 0, stats.processed, stats.get_rate())
+            
+            from core.entity.config import FONT_REGISTRY
+            logging.getLogger(__name__).info(f'字体缓存节省了 {FONT_REGISTRY.saved_loads} 次字体加载')
             
             # 处理完成
-            if not self.stop_event:
+            if not self.runner.is_stopped():
                 self.processing_finished.emit()
             
         except Exception as e:
@@ -193,77 +77,31 @@ class ProcessingThread(QThread):
             logger = logging.getLogger(__name__)
             logger.error(error_msg, exc_info=True)
             self.error_occurred.emit(error_msg)
-            
-    def _start_next_worker(self):
-        """启动下一个工作线程"""
-        if self.file_queue.empty() or self.stop_event:
-            return
+    
+    def _scan(self):
+        """扫描输入目录，同时统计已找到的图片数"""
+        from utils import iter_image_files
         
-        file_path = self.file_queue.get()
-        self.queued -= 1
-        
-        # 创建工作线程
-        worker = ImageWorker(self.config, file_path, self.output_dir, self.processor_chain)
-        worker.signals.started.connect(self._on_worker_started)
-        worker.signals.finished.connect(self._on_worker_finished)
-        worker.signals.error.connect(self._on_worker_error)
-        
-        # 将工作线程添加到活动列表
-        self.active_workers[file_path] = worker
-        
-        # 启动工作线程
-        self.thread_pool.start(worker)
-        
-    def _on_worker_started(self, file_path):
-        """工作线程开始处理信号槽"""
-        self.processing += 1
-        
-    def _on_worker_finished(self, file_path):
-        """工作线程完成处理信号槽"""
-        self.processing -= 1
-        self.processed += 1
-        
-        # 从活动列表中移除并清理工作线程对象
-        if file_path in self.active_workers:
-            worker = self.active_workers[file_path]
-            # 断开所有信号连接
-            worker.signals.started.disconnect(self._on_worker_started)
-            worker.signals.finished.disconnect(self._on_worker_finished)
-            worker.signals.error.disconnect(self._on_worker_error)
-            del self.active_workers[file_path]
-        
-        # 启动下一个工作线程
-        self._start_next_worker()
-        
-    def _on_worker_error(self, error_msg):
-        """工作线程错误信号槽"""
-        self.processing -= 1
-        self.failed += 1
-        
-        # 向主线程发送错误信息
-        self.error_occurred.emit(error_msg)
-        
-        # 启动下一个工作线程
-        self._start_next_worker()
-        
-    def _cleanup_workers(self):
-        """清理所有工作线程"""
-        # 断开所有信号连接
-        for file_path, worker in list(self.active_workers.items()):
-            try:
-                worker.signals.started.disconnect(self._on_worker_started)
-                worker.signals.finished.disconnect(self._on_worker_finished)
-                worker.signals.error.disconnect(self._on_worker_error)
-            except:
-                pass
-        # 清空活动工作线程列表
-        self.active_workers.clear()
+        for path in iter_image_files(self.input_dir, self.config.is_recursive(), exclude=self.output_dir):
+            self.total_files += 1
+            yield path
+    
+    def _on_result(self, file_path, target_path, error):
+        """单张图片处理完成，在工作线程中调用"""
+        if error is not None:
+            self.error_occurred.emit(f"处理文件 {file_path.name} 时出错: {str(error)}")
+    
+    def _on_progress(self, stats):
+        """推送统计信息和进度，在工作线程中调用"""
+        self.stats_updated.emit(stats.get_backlog(self.total_files), stats.processing, stats.processed, stats.get_rate())
+        # 扫描尚未结束时，进度相对于目前已找到的图片数
+        progress = int(((stats.processed + stats.failed + stats.skipped) / max(self.total_files, 1)) * 100)
+        self.progress_updated.emit(progress)
     
     def stop(self):
         """停止处理线程"""
-        self.stop_event = True
-        # 清理所有工作线程
-        self._cleanup_workers()
+        if self.runner is not None:
+            self.runner.stop()
 
 
 class MainWindow(FluentWindow):
@@ -751,9 +589,6 @@ class MainWindow(FluentWindow):
         """处理完成"""
         self.process_btn.setEnabled(True)
         self.progress_bar.setVisible(False)
-        # 确保统计信息显示最终状态
-        from utils import get_file_list
-        self.update_stats(0, 0, int(self.progress_bar.value() * len(get_file_list(self.input_path_edit.text())) / 100), 0)
         QMessageBox.information(self, "完成", "图片处理完成！")
         
     def processing_error(self, error_msg):
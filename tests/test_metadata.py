@@ -0,0 +1,52 @@
+"""
+保存时就地修改 exif 和 XMP：方向和尺寸更新，MakerNote 等数据的位置不变
+"""
+from PIL import Image
+from PIL.ExifTags import Base
+from PIL.ExifTags import IFD
+
+import core  # noqa: F401  utils 与 core 互相导入，需先导入 core
+from core.entity.image_container import _patch_exif
+from core.entity.image_container import _patch_xmp
+
+MAKER_NOTE = 0x927c
+
+
+def make_exif() -> bytes:
+    exif = Image.Exif()
+    exif[Base.Orientation] = 6
+    exif[Base.Make] = 'Canon'
+    exif.get_ifd(IFD.Exif).update({Base.ExifImageWidth: 4000, Base.ExifImageHeight: 3000,
+                                   MAKER_NOTE: b'MAKERNOTE' * 10})
+    return exif.tobytes()
+
+
+def test_patch_exif_keeps_layout():
+    data = make_exif()
+    patched = _patch_exif(data, True, 3000, 4000)
+    assert len(patched) == len(data)
+    maker_note = data.index(b'MAKERNOTE')
+    assert patched.index(b'MAKERNOTE') == maker_note
+
+    exif = Image.Exif()
+    exif.load(patched)
+    assert exif[Base.Orientation] == 1
+    exif_ifd = exif.get_ifd(IFD.Exif)
+    assert (exif_ifd[Base.ExifImageWidth], exif_ifd[Base.ExifImageHeight]) == (3000, 4000)
+    assert exif_ifd[MAKER_NOTE] == b'MAKERNOTE' * 10
+
+
+def test_patch_exif_widens_short_dimensions():
+    exif = Image.Exif()
+    exif.load(_patch_exif(make_exif(), False, 70000, 200))
+    assert exif[Base.Orientation] == 6
+    assert exif.get_ifd(IFD.Exif)[Base.ExifImageWidth] == 70000
+
+
+def test_patch_xmp():
+    xmp = (b'<rdf:Description tiff:Orientation="6" exif:PixelXDimension=\'4000\'>'
+           b'<tiff:ImageLength>3000</tiff:ImageLength></rdf:Description>')
+    assert _patch_xmp(xmp, True, 3000, 4000) == (
+        b'<rdf:Description tiff:Orientation="1" exif:PixelXDimension=\'3000\'>'
+        b'<tiff:ImageLength>4000</tiff:ImageLength></rdf:Description>')
+    assert b'tiff:Orientation="6"' in _patch_xmp(xmp, False, 3000, 4000)
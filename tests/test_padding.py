@@ -0,0 +1,184 @@
+"""
+填充、圆角、阴影和水印布局：直接在 RGB 画布上按单通道蒙版粘贴的实现与原来整张图片转为 RGBA 的实现输出相同
+"""
+import random
+
+import pytest
+from PIL import Image
+from PIL import ImageChops
+from PIL import ImageDraw
+from PIL import ImageFilter
+from PIL import ImageOps
+
+import core  # noqa: F401  utils 与 core 互相导入，需先导入 core
+from core.entity.image_container import ImageContainer
+from init import WATERMARK_PROCESSOR
+from utils import add_rounded_corners
+from utils import add_soft_shadow
+from utils import expand_image
+from utils import padding_image
+from utils import rounded_corner_mask
+from utils import soft_shadow_mask
+
+
+def old_padding_image(image, padding_size, padding_location='tb', color=(0, 0, 0, 0)):
+    total_width, total_height = image.size
+    x_offset, y_offset = 0, 0
+    if 't' in padding_location:
+        total_height += padding_size
+        y_offset += padding_size
+    if 'b' in padding_location:
+        total_height += padding_size
+    if 'l' in padding_location:
+        total_width += padding_size
+        x_offset += padding_size
+    if 'r' in padding_location:
+        total_width += padding_size
+
+    padding_img = Image.new('RGBA', (total_width, total_height), color=color)
+    padding_img.paste(image, (x_offset, y_offset))
+    return padding_img
+
+
+def old_add_rounded_corners(image, radius):
+    rounded_img = Image.new("RGBA", image.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(rounded_img)
+    draw.rounded_rectangle([(0, 0), image.size], radius=radius, fill=(255, 255, 255, 255))
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    rounded_img.paste(image, mask=rounded_img)
+    return rounded_img
+
+
+def old_add_soft_shadow(image, radius=25, opacity=128):
+    shadow_margin = radius * 2
+    shadow_width = image.width + shadow_margin * 2
+    shadow_height = image.height + shadow_margin * 2
+    result = Image.new("RGBA", (shadow_width, shadow_height), (0, 0, 0, 0))
+
+    shadow_layer = Image.new("RGBA", (shadow_width, shadow_height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(shadow_layer)
+    draw.rectangle(
+        [(shadow_margin, shadow_margin), (shadow_margin + image.width, shadow_margin + image.height)],
+        fill=(0, 0, 0, opacity)
+    )
+    shadow_layer = shadow_layer.filter(ImageFilter.GaussianBlur(radius=radius))
+    shadow_layer = shadow_layer.filter(ImageFilter.GaussianBlur(radius=radius // 2))
+
+    result.paste(shadow_layer, (0, 0), shadow_layer)
+    result.paste(image, (shadow_margin, shadow_margin), image)
+    return result
+
+
+def random_image(size, mode='RGB', seed=0):
+    rng = random.Random(seed)
+    return Image.frombytes(mode, size, rng.randbytes(size[0] * size[1] * len(mode)))
+
+
+def assert_same_pixels(a, b):
+    assert a.mode == b.mode
+    assert a.size == b.size
+    assert ImageChops.difference(a, b).getbbox() is None
+
+
+@pytest.mark.parametrize('location', ['tb', 'lr', 'tlrb', 't', 'r'])
+@pytest.mark.parametrize('color', ['white', 'black', (12, 34, 56), '#ff8800'])
+def test_padding_rgb_matches_rgba(location, color):
+    image = random_image((37, 23))
+    new = padding_image(image, 9, location, color=color)
+    assert new.mode == 'RGB'
+    assert_same_pixels(new, old_padding_image(image, 9, location, color=color).convert('RGB'))
+
+
+def test_padding_transparent_stays_rgba():
+    image = random_image((37, 23), 'RGBA')
+    assert_same_pixels(padding_image(image, 9, 'tlrb'), old_padding_image(image, 9, 'tlrb'))
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA'])
+@pytest.mark.parametrize('radius', [0, 3, 10])
+def test_rounded_corners(mode, radius):
+    image = random_image((60, 40), mode, seed=radius)
+    assert_same_pixels(add_rounded_corners(image, radius), old_add_rounded_corners(image, radius))
+
+
+@pytest.mark.parametrize('radius,opacity', [(4, 128), (6, 255), (10, 256)])
+def test_soft_shadow(radius, opacity):
+    image = old_add_rounded_corners(random_image((50, 30)), 3)
+    assert_same_pixels(add_soft_shadow(image, radius, opacity), old_add_soft_shadow(image, radius, opacity))
+
+
+@pytest.mark.parametrize('radius,opacity', [(4, 128), (6, 255), (10, 256)])
+def test_blur_layout_composite(radius, opacity):
+    # 与 BackgroundBlurWithParamsProcessor 相同：原来先生成带圆角和阴影的 RGBA 图层再粘贴，
+    # 现在按阴影蒙版贴黑色、按圆角蒙版贴 RGB 原图
+    image = random_image((50, 30), seed=1)
+    background = random_image((120, 100), seed=2)
+    shadow_margin = radius * 2
+    x, y = 7, 5
+
+    old = background.copy()
+    shadow_img = old_add_soft_shadow(old_add_rounded_corners(image, 3), radius, opacity)
+    old.paste(shadow_img, (x, y), shadow_img)
+
+    new = background.copy()
+    shadow_mask = soft_shadow_mask(image.size, radius, opacity)
+    new.paste((0, 0, 0), (x, y, x + shadow_mask.width, y + shadow_mask.height), shadow_mask)
+    new.paste(image, (x + shadow_margin, y + shadow_margin), rounded_corner_mask(image.size, 3))
+
+    assert_same_pixels(new, old)
+
+
+def old_watermark_composite(image, watermark, bg_color):
+    bg = ImageOps.expand(image.convert('RGBA'), border=(0, 0, 0, watermark.height), fill=bg_color)
+    fg = ImageOps.expand(watermark, border=(0, image.height, 0, 0), fill=(0, 0, 0, 0))
+    return Image.alpha_composite(bg, fg).convert('RGB')
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA'])
+@pytest.mark.parametrize('bg_color', ['#ffffff', '#212121'])
+def test_watermark_composite(tmp_path, monkeypatch, mode, bg_color):
+    # 水印布局一次性创建 RGB 画布按水印条的透明度粘贴，与原来的 alpha_composite 相差不超过 1
+    path = tmp_path.joinpath('photo.png')
+    random_image((64, 48), mode, seed=3).save(path)
+    strip = random_image((640, 100), 'RGBA', seed=4)
+    monkeypatch.setattr(WATERMARK_PROCESSOR, 'bg_color', bg_color)
+    monkeypatch.setattr(WATERMARK_PROCESSOR, 'is_strip_cacheable', lambda: False)
+    monkeypatch.setattr(WATERMARK_PROCESSOR, 'build_watermark', lambda container, context, texts: strip.copy())
+
+    container = ImageContainer(path, exif={})
+    image = container.get_watermark_img().copy()
+    WATERMARK_PROCESSOR.process(container)
+    watermark = strip.resize((image.width, round(strip.height * image.width / strip.width)), Image.LANCZOS)
+
+    new = container.get_watermark_img()
+    old = old_watermark_composite(image, watermark, bg_color)
+    assert new.mode == old.mode and new.size == old.size
+    assert max(high for _, high in ImageChops.difference(new, old).getextrema()) <= 1
+
+
+def random_paddings(rng, image, stages):
+    # 负数填充为裁剪，保证每一层之后图片仍有内容
+    paddings = []
+    width, height = image.size
+    for _ in range(stages):
+        left, top, right, bottom = (rng.randint(-min(width, height) // 4, 12) for _ in range(4))
+        color = rng.choice(['white', 'black', '#2b2b2b', (10, 200, 30)])
+        paddings.append((left, top, right, bottom, color))
+        width, height = width + left + right, height + top + bottom
+    return paddings
+
+
+@pytest.mark.parametrize('stages', [1, 2, 3, 4])
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA'])
+def test_expand_image_matches_sequential_expand(stages, mode):
+    # 处理器链合并连续的填充后一次性创建画布，与逐层 ImageOps.expand 的结果相同
+    rng = random.Random(stages)
+    for seed in range(50):
+        image = random_image((40, 30), mode, seed=seed)
+        paddings = random_paddings(rng, image, stages)
+
+        old = image
+        for left, top, right, bottom, color in paddings:
+            old = ImageOps.expand(old, border=(left, top, right, bottom), fill=color)
+        assert_same_pixels(expand_image(image, paddings), old)
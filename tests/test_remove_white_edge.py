@@ -0,0 +1,54 @@
+"""
+remove_white_edge：按与背景色的差求外接矩形，与原来逐像素比较的实现裁剪结果相同
+"""
+import random
+
+import pytest
+from PIL import Image
+from PIL import ImageChops
+
+import core  # noqa: F401  utils 与 core 互相导入，需先导入 core
+from utils import remove_white_edge
+
+
+def old_remove_white_edge(image):
+    pixels = image.load()
+    width, height = image.size
+    min_x, min_y = width - 1, height - 1
+    max_x, max_y = 0, 0
+    for y in range(height):
+        for x in range(width):
+            if pixels[x, y] != (255, 255, 255):
+                min_x = min(min_x, x)
+                min_y = min(min_y, y)
+                max_x = max(max_x, x)
+                max_y = max(max_y, y)
+    return image.crop((min_x, min_y, max_x + 1, max_y + 1))
+
+
+def make_frame(rng, size=(60, 40)):
+    # 白色边框中间是随机内容，边框中再撒几个噪点
+    image = Image.new('RGB', size, 'white')
+    left, top = rng.randint(0, 20), rng.randint(0, 12)
+    width, height = rng.randint(1, size[0] - left), rng.randint(1, size[1] - top)
+    content = Image.frombytes('RGB', (width, height), rng.randbytes(width * height * 3))
+    image.paste(content, (left, top))
+    for _ in range(rng.randint(0, 3)):
+        # 只差一个色阶的噪点在容差为 0 时也算内容
+        image.putpixel((rng.randrange(size[0]), rng.randrange(size[1])), rng.choice([(254, 255, 255), (0, 0, 0)]))
+    return image
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_same_crop_as_pixel_loop(seed):
+    image = make_frame(random.Random(seed))
+    new, old = remove_white_edge(image), old_remove_white_edge(image)
+    assert new.size == old.size
+    assert ImageChops.difference(new, old).getbbox() is None
+
+
+@pytest.mark.parametrize('mode', ['RGBA', 'L'])
+def test_non_rgb_not_cropped(mode):
+    image = Image.new(mode, (30, 20), 'white' if mode == 'L' else (255, 255, 255, 0))
+    image.paste(Image.new(mode, (5, 5), 0), (10, 8))
+    assert remove_white_edge(image).size == image.size
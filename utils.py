@@ -1,15 +1,33 @@
+import atexit
+import io
+import json
 import logging
+import os
 import platform
+import queue
 import re
 import shutil
 import subprocess
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
 from pathlib import Path
 
 from PIL import Image
+from PIL import ImageChops
+from PIL import ImageColor
 from PIL import ImageDraw
 from PIL import ImageFilter
 from PIL import ImageOps
 
+
+try:
+    from PIL import ImageCms
+except ImportError:
+    # Pillow 未编译 LittleCMS 时不支持色彩空间转换
+    ImageCms = None
+
 from core.enums.constant import TRANSPARENT
 
 if platform.system() == 'Windows':
@@ -24,6 +42,43 @@ else:
 
 logger = logging.getLogger(__name__)
 
+# 支持处理的图片后缀，不区分大小写
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png'}
+
+
+def is_image_file(name) -> bool:
+    """
+    根据后缀判断是否为支持处理的图片
+    :param name: 文件名或路径
+    """
+    return os.path.splitext(name)[1].lower() in IMAGE_SUFFIXES
+
+
+def iter_image_files(path, recursive=False, exclude=None):
+    """
+    边扫描边返回目录中的图片，不必等待整个目录列出
+    :param path: 路径
+    :param recursive: 是否扫描子目录
+    :param exclude: 不扫描的目录，例如位于输入目录中的输出目录
+    :return: 生成图片路径
+    """
+    exclude = os.path.realpath(exclude) if exclude is not None else None
+    directories = [os.fspath(path)]
+    while directories:
+        directory = directories.pop()
+        try:
+            entries = os.scandir(directory)
+        except OSError as e:
+            logger.error(f'无法读取目录 {directory}: {e}')
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_file() and is_image_file(entry.name):
+                    yield Path(entry.path)
+                elif recursive and entry.is_dir(follow_symlinks=False) \
+                        and os.path.realpath(entry.path) != exclude:
+                    directories.append(entry.path)
+
 
 def get_file_list(path):
     """
@@ -31,9 +86,193 @@ def get_file_list(path):
     :param path: 路径
     :return: 文件名
     """
-    path = Path(path, encoding=ENCODING)
-    return [file_path for file_path in path.iterdir()
-            if file_path.is_file() and file_path.suffix in ['.jpg', '.jpeg', '.JPG', '.JPEG', '.png', '.PNG']]
+    return list(iter_image_files(path))
+
+
+# 单条 exiftool 命令的最长等待时间，单位为秒，超时后结束进程
+EXIFTOOL_TIMEOUT = 60
+
+
+class ExifToolSession(object):
+    """
+    常驻的 exiftool 进程（-stay_open 模式），避免每张照片都重新启动一次 Perl 解释器
+    """
+
+    def __init__(self, executable=None, timeout=EXIFTOOL_TIMEOUT):
+        """
+        :param executable: exiftool 路径
+        :param timeout: 单条命令的最长等待时间，单位为秒
+        """
+        self._executable = executable if executable is not None else EXIFTOOL_PATH
+        self.timeout = timeout
+        self._process = None
+        self._lines = None
+        self._sequence = 0
+
+    def start(self) -> None:
+        """
+        启动 exiftool 进程，参数通过 stdin 逐行传入；
+        输出由单独的线程逐行读取，这样读取可以设置超时（Windows 的管道不支持 select）
+        """
+        self._process = subprocess.Popen([self._executable, '-stay_open', 'True', '-@', '-'],
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         stderr=subprocess.DEVNULL)
+        self._lines = queue.Queue()
+        threading.Thread(target=self._read_output, args=(self._process.stdout, self._lines), daemon=True).start()
+        self._sequence = 0
+
+    @staticmethod
+    def _read_output(stdout, lines: queue.Queue) -> None:
+        for line in iter(stdout.readline, b''):
+            lines.put(line)
+        # 空行表示进程已退出
+        lines.put(b'')
+
+    def is_alive(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def execute(self, *args) -> bytes:
+        """
+        执行一条 exiftool 命令，返回该命令的全部输出
+        :param args: 命令参数
+        :return: 输出内容（不包含 {ready} 标记）
+        """
+        if not self.is_alive():
+            self.start()
+        self._sequence += 1
+        marker = f'{{ready{self._sequence}}}'.encode('ascii')
+        # 每个参数占一行，文件名统一使用 utf-8 传入
+        command = ['-charset', 'filename=utf8', *[str(arg) for arg in args], f'-execute{self._sequence}']
+        self._process.stdin.write(('\n'.join(command) + '\n').encode('utf-8'))
+        self._process.stdin.flush()
+
+        output = []
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                line = self._lines.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                raise TimeoutError(f'exiftool 在 {self.timeout} 秒内没有响应') from None
+            if not line:
+                raise BrokenPipeError('exiftool 进程意外退出')
+            if line.rstrip() == marker:
+                break
+            output.append(line)
+        return b''.join(output)
+
+    def close(self) -> None:
+        if self._process is None:
+            return
+        try:
+            if self.is_alive():
+                self._process.stdin.write(b'-stay_open\nFalse\n')
+                self._process.stdin.flush()
+                self._process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self._process.kill()
+        finally:
+            self._process = None
+
+    def kill(self) -> None:
+        """
+        强制结束没有响应的进程
+        """
+        if self._process is None:
+            return
+        self._process.kill()
+        self._process.wait()
+        self._process = None
+
+
+class ExifToolPool(object):
+    """
+    exiftool 会话池，每个工作线程独占一个会话，进程崩溃或超时后自动重启；
+    线程退出前应调用 release() 关闭自己的会话，否则进程会一直保留到程序退出
+    """
+
+    def __init__(self, executable=None):
+        self._executable = executable
+        self._local = threading.local()
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    def _get_session(self) -> ExifToolSession:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = ExifToolSession(self._executable)
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def execute(self, *args) -> bytes:
+        """
+        在当前线程的会话中执行命令，会话崩溃时重启并重试一次
+        """
+        session = self._get_session()
+        try:
+            return session.execute(*args)
+        except TimeoutError as e:
+            # 卡住的命令重试多半还会卡住，结束进程后直接报错，下一条命令会启动新进程
+            logger.warning(f'exiftool session timed out, restarting: {e}')
+            session.kill()
+            raise
+        except (BrokenPipeError, ValueError) as e:
+            logger.warning(f'exiftool session crashed, restarting: {e}')
+            session.close()
+            session.start()
+            return session.execute(*args)
+
+    def release(self) -> None:
+        """
+        关闭当前线程的会话
+        """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            return
+        self._local.session = None
+        with self._lock:
+            if session in self._sessions:
+                self._sessions.remove(session)
+        session.close()
+
+    def close(self) -> None:
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            session.close()
+
+
+EXIFTOOL_POOL = ExifToolPool()
+atexit.register(EXIFTOOL_POOL.close)
+
+
+def parse_exif_output(output: str) -> dict:
+    """
+    解析 exiftool 默认格式的输出
+    :param output: exiftool 输出内容
+    :return: exif信息
+    """
+    exif_dict = {}
+    for line in output.splitlines():
+        # 将每一行按冒号分隔成键值对
+        kv_pair = line.split(':')
+        if len(kv_pair) < 2:
+            continue
+        key = kv_pair[0].strip()
+        value = ':'.join(kv_pair[1:]).strip()
+        # 将键中的空格移除
+        key = re.sub(r'\s+', '', key)
+        key = re.sub(r'/', '', key)
+        # 将键值对添加到字典中
+        exif_dict[key] = value
+    for key, value in exif_dict.items():
+        # 过滤非 ASCII 字符
+        value_clean = ''.join(c for c in value if ord(c) < 128)
+        # 将处理后的值更新到 exif_dict 中
+        exif_dict[key] = value_clean
+    return exif_dict
 
 
 def get_exif(path) -> dict:
@@ -44,81 +283,138 @@ def get_exif(path) -> dict:
     """
     exif_dict = {}
     try:
-        output_bytes = subprocess.check_output([EXIFTOOL_PATH, '-d', '%Y-%m-%d %H:%M:%S%3f%z', path])
-        output = output_bytes.decode('utf-8', errors='ignore')
-
-        lines = output.splitlines()
-        utf8_lines = [line for line in lines]
-
-        for line in utf8_lines:
-            # 将每一行按冒号分隔成键值对
-            kv_pair = line.split(':')
-            if len(kv_pair) < 2:
-                continue
-            key = kv_pair[0].strip()
-            value = ':'.join(kv_pair[1:]).strip()
-            # 将键中的空格移除
-            key = re.sub(r'\s+', '', key)
-            key = re.sub(r'/', '', key)
-            # 将键值对添加到字典中
-            exif_dict[key] = value
-        for key, value in exif_dict.items():
-            # 过滤非 ASCII 字符
-            value_clean = ''.join(c for c in value if ord(c) < 128)
-            # 将处理后的值更新到 exif_dict 中
-            exif_dict[key] = value_clean
+        output_bytes = EXIFTOOL_POOL.execute('-d', '%Y-%m-%d %H:%M:%S%3f%z', path)
+        exif_dict = parse_exif_output(output_bytes.decode('utf-8', errors='ignore'))
     except Exception as e:
         logger.error(f'get_exif error: {path} : {e}')
 
     return exif_dict
 
 
-def insert_exif(source_path, target_path) -> None:
+# 批量预读时每次交给 exiftool 的文件数，限制单次输出的大小
+EXIF_PREFETCH_CHUNK_SIZE = 256
+# JSON 模式输出的是标签名，这里映射为默认输出格式中的字段名，保持与 get_exif 一致
+JSON_KEY_ALIASES = {
+    'Model': 'CameraModelName',
+    'FocalLength35efl': 'FocalLength',
+}
+
+
+def normalize_json_exif(item: dict) -> dict:
     """
-    复制照片的 exif 信息
-    :param source_path: 源照片路径
-    :param target_path: 目的照片路径
+    将 exiftool JSON 输出中的单个文件条目转换为 get_exif 的格式
+    :param item: JSON 条目
+    :return: exif信息
     """
-    try:
-        # 将 exif 信息转换为字节串
-        subprocess.check_output([EXIFTOOL_PATH, '-tagsfromfile', source_path, '-overwrite_original', target_path])
-    except ValueError as e:
-        logger.exception(f'ValueError: {source_path}: cannot insert exif {str(e)}')
+    exif_dict = {}
+    aliases = {}
+    for key, value in item.items():
+        if key == 'SourceFile':
+            continue
+        if isinstance(value, list):
+            value = ', '.join(str(v) for v in value)
+        # 过滤非 ASCII 字符
+        value_clean = ''.join(c for c in str(value) if ord(c) < 128).strip()
+        if key in JSON_KEY_ALIASES:
+            aliases[JSON_KEY_ALIASES[key]] = value_clean
+        else:
+            exif_dict[key] = value_clean
+    # 与默认输出格式一样，复合标签覆盖同名的原始标签
+    exif_dict.update(aliases)
+    return exif_dict
 
 
-TINY_HEIGHT = 800
+def normalize_source_file(path) -> str:
+    """
+    规范化路径以便与 exiftool 输出的 SourceFile 对应：Windows 下 exiftool 统一使用正斜杠，且不区分大小写
+    :param path: 路径
+    """
+    return os.path.normcase(os.path.normpath(path))
 
 
-def remove_white_edge(image):
+def prefetch_exif(paths, chunk_size=EXIF_PREFETCH_CHUNK_SIZE):
     """
-    移除图片白边
-    :param image: 图片对象
-    :return: 移除白边后的图片对象
+    分批调用 exiftool 读取一组照片的 exif 信息
+    :param paths: 照片路径，可以是迭代器
+    :param chunk_size: 每批的文件数
+    :return: 生成 (照片路径, exif信息) 元组
+    """
+    paths = iter(paths)
+    while True:
+        chunk = {normalize_source_file(path): path for path in islice(paths, chunk_size)}
+        if not chunk:
+            return
+        try:
+            output_bytes = EXIFTOOL_POOL.execute('-j', '-d', '%Y-%m-%d %H:%M:%S%3f%z', *chunk.values())
+            items = json.loads(output_bytes.decode('utf-8', errors='ignore') or '[]')
+        except Exception as e:
+            logger.error(f'prefetch_exif error: {len(chunk)} files from {next(iter(chunk.values()))} : {e}')
+            continue
+        unmatched = []
+        for item in items:
+            path = chunk.get(normalize_source_file(item.get('SourceFile', '')))
+            if path is None:
+                unmatched.append(item.get('SourceFile'))
+                continue
+            yield path, normalize_json_exif(item)
+        if unmatched:
+            logger.warning(f'prefetch_exif: {len(unmatched)} results do not match any input path, '
+                           f'e.g. {unmatched[0]}; these files will be read one by one')
+
+
+def build_exif_map(paths, chunk_size=EXIF_PREFETCH_CHUNK_SIZE) -> dict:
+    """
+    预读整个目录的 exif 信息
+    :param paths: 照片路径列表
+    :param chunk_size: 每批的文件数
+    :return: 照片路径到 exif信息 的映射，读取失败的照片不在其中
     """
-    # 获取像素信息
-    pixels = image.load()
+    return dict(prefetch_exif(paths, chunk_size))
 
-    # 获取图像大小
-    width, height = image.size
 
-    # 计算最小的 X、Y、最大的 X、Y 坐标
-    min_x, min_y = width - 1, height - 1
-    max_x, max_y = 0, 0
-    for y in range(height):
-        for x in range(width):
-            if pixels[x, y] != (255, 255, 255):
-                min_x = min(min_x, x)
-                min_y = min(min_y, y)
-                max_x = max(max_x, x)
-                max_y = max(max_y, y)
+def stream_with_exif(paths, exif_map: dict, chunk_size=EXIF_PREFETCH_CHUNK_SIZE):
+    """
+    逐批预读 exif 信息并依次返回照片，扫描到第一批照片后即可开始处理
+    :param paths: 照片路径，可以是迭代器
+    :param exif_map: 读取到的 exif 信息放入其中
+    :param chunk_size: 每批的文件数
+    :return: 生成照片路径
+    """
+    paths = iter(paths)
+    while True:
+        chunk = list(islice(paths, chunk_size))
+        if not chunk:
+            return
+        exif_map.update(prefetch_exif(chunk, chunk_size))
+        yield from chunk
 
-    # 计算新的图像大小
-    new_width = max_x - min_x + 1
-    new_height = max_y - min_y + 1
 
-    # 裁剪图像
-    new_image = image.crop((min_x, min_y, max_x + 1, max_y + 1))
-    return new_image
+TINY_HEIGHT = 800
+
+
+def remove_white_edge(image, tolerance=0, background=(255, 255, 255)):
+    """
+    移除图片白边
+    :param image: 图片对象
+    :param tolerance: 容差，各通道与背景色相差都不超过该值的像素视为边缘
+    :param background: 边缘颜色，默认为白色
+    :return: 移除白边后的图片对象，与原来逐像素比较的实现一样只裁剪 RGB 图片，其他模式返回副本
+    """
+    if image.mode != 'RGB':
+        return image.copy()
+    background_img = Image.new('RGB', image.size, color=background)
+    # 与背景色逐像素求差，非零区域的外接矩形即为内容区域
+    diff = ImageChops.difference(image, background_img)
+    background_img.close()
+    if tolerance > 0:
+        diff = diff.point(lambda v: 255 if v > tolerance else 0)
+    bbox = diff.getbbox()
+    diff.close()
+
+    if bbox is None:
+        # 整张图片都是边缘
+        return image.copy()
+    return image.crop(bbox)
 
 
 def concatenate_image(images, align='left'):
@@ -178,11 +474,65 @@ def padding_image(image, padding_size, padding_location='tb', color=TRANSPARENT)
     if 'r' in padding_location:
         total_width += padding_size
 
-    padding_img = Image.new('RGBA', (total_width, total_height), color=color)
+    # RGB 图片用不透明颜色填充时结果仍为 RGB，避免整张图片转为 RGBA
+    mode = 'RGB' if image.mode == 'RGB' and is_opaque_color(color) else 'RGBA'
+    padding_img = Image.new(mode, (total_width, total_height), color=color)
     padding_img.paste(image, (x_offset, y_offset))
     return padding_img
 
 
+def expand_image(image, paddings) -> Image.Image:
+    """
+    在图片四周由内向外依次填充多层颜色，只创建一次画布、粘贴一次图片
+    :param image: 图片对象
+    :param paddings: 由内向外的各层填充 (左, 上, 右, 下, 颜色)，为负数时裁剪
+    :return: 填充后的图片对象，没有任何填充时返回原图片对象
+    """
+    if all(left == top == right == bottom == 0 for left, top, right, bottom, _ in paddings):
+        return image
+
+    # 逐层计算每层画布相对原图的位置
+    boxes = []
+    x0, y0, x1, y1 = 0, 0, image.width, image.height
+    for left, top, right, bottom, color in paddings:
+        x0, y0, x1, y1 = x0 - left, y0 - top, x1 + right, y1 + bottom
+        boxes.append((x0, y0, x1, y1, color))
+
+    # 最外层即最终画布，内层只在所有外层都可见的范围内才可见
+    clip_x0, clip_y0, clip_x1, clip_y1, color = boxes[-1]
+    offset_x, offset_y = -clip_x0, -clip_y0
+    opaque = all(is_opaque_color(box[4]) for box in boxes)
+    canvas = Image.new('RGB' if image.mode == 'RGB' and opaque else 'RGBA',
+                       (clip_x1 - clip_x0, clip_y1 - clip_y0), color=color)
+    for x0, y0, x1, y1, color in reversed(boxes[:-1]):
+        clip_x0, clip_y0 = max(clip_x0, x0), max(clip_y0, y0)
+        clip_x1, clip_y1 = min(clip_x1, x1), min(clip_y1, y1)
+        if clip_x0 < clip_x1 and clip_y0 < clip_y1:
+            canvas.paste(color, (clip_x0 + offset_x, clip_y0 + offset_y, clip_x1 + offset_x, clip_y1 + offset_y))
+
+    # 粘贴原图中仍然可见的部分
+    clip_x0, clip_y0 = max(clip_x0, 0), max(clip_y0, 0)
+    clip_x1, clip_y1 = min(clip_x1, image.width), min(clip_y1, image.height)
+    if clip_x0 < clip_x1 and clip_y0 < clip_y1:
+        if (clip_x0, clip_y0, clip_x1, clip_y1) == (0, 0, image.width, image.height):
+            canvas.paste(image, (offset_x, offset_y))
+        else:
+            visible = image.crop((clip_x0, clip_y0, clip_x1, clip_y1))
+            canvas.paste(visible, (clip_x0 + offset_x, clip_y0 + offset_y))
+            visible.close()
+    return canvas
+
+
+def is_opaque_color(color) -> bool:
+    """
+    判断颜色是否完全不透明
+    :param color: 颜色名称、十六进制字符串或 RGB/RGBA 元组
+    """
+    if isinstance(color, str):
+        color = ImageColor.getcolor(color, 'RGBA')
+    return len(color) < 4 or color[3] >= 255
+
+
 def square_image(image, auto_close=True) -> Image.Image:
     """
     将图片按照正方形进行填充
@@ -233,6 +583,24 @@ def resize_image_with_height(image, height, auto_close=True):
     return resized_image
 
 
+def resize_image_with_long_edge(image, long_edge, auto_close=True):
+    """
+    按照长边对图片进行等比缩小，先用 reduce() 整数倍缩小再精确缩放
+    :param image: 图片对象
+    :param long_edge: 指定长边
+    :param auto_close: 是否自动关闭图片对象
+    :return: 缩小后的图片对象，长边不超过指定值时返回原图片对象
+    """
+    scale = long_edge / max(image.size)
+    if scale >= 1:
+        return image
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    resized_image = image.resize(size, Image.LANCZOS, reducing_gap=2.0)
+    if auto_close:
+        image.close()
+    return resized_image
+
+
 def resize_image_with_width(image, width, auto_close=True):
     """
     按照宽度对图片进行缩放
@@ -258,6 +626,32 @@ def resize_image_with_width(image, width, auto_close=True):
     return resized_image
 
 
+def blur_image(image, radius, size=None, downscale=1, blur_first=True) -> Image.Image:
+    """
+    对图片进行高斯模糊并缩放到指定尺寸
+    :param image: 图片对象
+    :param radius: 模糊半径
+    :param size: 输出尺寸，默认与原图相同
+    :param downscale: 缩小倍数，大于 1 时先缩小、按比例缩小半径模糊后再放大，重度模糊下效果几乎一致
+    :param blur_first: 模糊半径是否按原图尺寸计算（先模糊后缩放），否则按输出尺寸计算（先缩放后模糊）
+    :return: 模糊后的图片对象
+    """
+    size = tuple(size) if size is not None else image.size
+    if downscale <= 1:
+        if blur_first:
+            blurred = image.filter(ImageFilter.GaussianBlur(radius=radius))
+            return blurred if blurred.size == size else blurred.resize(size)
+        return image.resize(size, Image.LANCZOS).filter(ImageFilter.GaussianBlur(radius=radius))
+
+    if blur_first:
+        # 将原图尺寸下的模糊半径换算到输出尺寸
+        radius = radius * size[0] / image.width
+    small_size = (max(1, size[0] // downscale), max(1, size[1] // downscale))
+    small = image.resize(small_size, Image.BILINEAR, reducing_gap=2.0)
+    small = small.filter(ImageFilter.GaussianBlur(radius=radius * small_size[0] / size[0]))
+    return small.resize(size, Image.BICUBIC)
+
+
 def append_image_by_side(background, images, side='left', padding=200, is_start=False):
     """
     将图片横向拼接到背景图片中
@@ -295,18 +689,88 @@ def append_image_by_side(background, images, side='left', padding=200, is_start=
             x_offset += padding
 
 
+class ImageCache(object):
+    """
+    按字节预算淘汰的 LRU 图片缓存，线程安全
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._images = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _sizeof(image) -> int:
+        return image.width * image.height * len(image.getbands())
+
+    def get(self, key, copy=True) -> Image.Image | None:
+        """
+        获取缓存的图片
+        :param key: 缓存键
+        :param copy: 是否返回副本，调用方会修改图片时必须使用副本
+        :return: 图片对象，未命中时返回 None
+        """
+        with self._lock:
+            image = self._images.get(key)
+            if image is None:
+                return None
+            self._images.move_to_end(key)
+        return image.copy() if copy else image
+
+    def put(self, key, image) -> None:
+        """
+        缓存图片，超出预算时淘汰最久未使用的图片；调用方之后不应再修改该图片
+        """
+        size = self._sizeof(image)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._images:
+                self._bytes -= self._sizeof(self._images.pop(key))
+            self._images[key] = image
+            self._bytes += size
+            self._evict()
+
+    def set_max_bytes(self, max_bytes) -> None:
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._images.clear()
+            self._bytes = 0
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and self._images:
+            _, image = self._images.popitem(last=False)
+            self._bytes -= self._sizeof(image)
+
+
+# 已渲染的文字图块，同一批照片中机型、厂商、镜头等文字大量重复
+TEXT_TILE_CACHE = ImageCache(max_bytes=128 * 1024 * 1024)
+
+
 def text_to_image(content, font, bold_font, is_bold=False, fill='black') -> Image.Image:
     """
-    将文字内容转换为图片
+    将文字内容转换为图片，相同的文字只渲染一次
     """
     if is_bold:
         font = bold_font
     if content == '':
         content = '   '
+    key = (content, getattr(font, 'path', None), getattr(font, 'size', None), is_bold, fill)
+    if key[1] is not None:
+        image = TEXT_TILE_CACHE.get(key)
+        if image is not None:
+            return image
     _, _, text_width, text_height = font.getbbox(content)
     image = Image.new('RGBA', (text_width, text_height), color=TRANSPARENT)
     draw = ImageDraw.Draw(image)
     draw.text((0, 0), content, fill=fill, font=font)
+    if key[1] is not None:
+        TEXT_TILE_CACHE.put(key, image.copy())
     return image
 
 
@@ -401,6 +865,43 @@ def extract_gps_info(gps_info: str):
     return extract_gps_lat_and_long(lat, long)
 
 
+def rounded_corner_mask(size, radius) -> Image.Image:
+    """
+    生成圆角矩形蒙版，只有一个通道，用于粘贴时裁出圆角
+    :param size: 蒙版尺寸
+    :param radius: 圆角半径
+    :return: 'L' 模式的蒙版
+    """
+    mask = Image.new('L', size, 0)
+    ImageDraw.Draw(mask).rounded_rectangle([(0, 0), size], radius=radius, fill=255)
+    return mask
+
+
+def soft_shadow_mask(size, radius=25, opacity=128) -> Image.Image:
+    """
+    生成由内向外逐渐变淡的阴影蒙版，四周各留出 radius * 2 的扩散空间，
+    用黑色按此蒙版粘贴即可得到阴影
+    :param size: 投射阴影的图片尺寸
+    :param radius: 阴影模糊半径，控制阴影的扩散范围和柔和度
+    :param opacity: 阴影不透明度 (0-255)
+    :return: 'L' 模式的蒙版
+    """
+    shadow_margin = radius * 2
+    mask = Image.new('L', (size[0] + shadow_margin * 2, size[1] + shadow_margin * 2), 0)
+    ImageDraw.Draw(mask).rectangle(
+        [(shadow_margin, shadow_margin), (shadow_margin + size[0], shadow_margin + size[1])],
+        fill=min(opacity, 255)
+    )
+    # 多次应用模糊可以获得更柔和的效果
+    mask = mask.filter(ImageFilter.GaussianBlur(radius=radius))
+    mask = mask.filter(ImageFilter.GaussianBlur(radius=radius // 2))
+    # 阴影层按自身透明度贴到透明背景上，透明度相当于平方；
+    # 用 paste 而不是 ImageChops.multiply，后者截断小数，与原来 RGBA 图层的取整方式不同
+    alpha = Image.new('L', mask.size, 0)
+    alpha.paste(mask, mask=mask)
+    return alpha
+
+
 def add_rounded_corners(image, radius):
     """
     为图片添加圆角效果
@@ -409,24 +910,11 @@ def add_rounded_corners(image, radius):
     :param radius: 圆角半径
     :return: 添加圆角后的图片对象
     """
-    # 创建一个与原图大小相同的透明背景
-    rounded_img = Image.new("RGBA", image.size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(rounded_img)
-    
-    # 绘制圆角矩形
-    draw.rounded_rectangle(
-        [(0, 0), image.size],
-        radius=radius,
-        fill=(255, 255, 255, 255)
-    )
-    
-    # 如果原图不是RGBA模式，转换为RGBA模式
-    if image.mode != "RGBA":
-        image = image.convert("RGBA")
-    
-    # 将原图与圆角矩形蒙版合并
-    rounded_img.paste(image, mask=rounded_img)
-    
+    rounded_img = image.convert("RGBA")
+    mask = rounded_corner_mask(image.size, radius)
+    if image.mode == "RGBA":
+        mask = ImageChops.multiply(mask, image.getchannel("A"))
+    rounded_img.putalpha(mask)
     return rounded_img
 
 
@@ -439,36 +927,78 @@ def add_soft_shadow(image, radius=25, opacity=128):
     :param opacity: 阴影不透明度 (0-255)
     :return: 添加阴影后的图片对象
     """
-    # 创建一个比原图大的透明背景，以容纳四周扩散的阴影
-    # 阴影半径的2倍，确保阴影有足够的空间扩散
     shadow_margin = radius * 2
-    shadow_width = image.width + shadow_margin * 2
-    shadow_height = image.height + shadow_margin * 2
-    result = Image.new("RGBA", (shadow_width, shadow_height), (0, 0, 0, 0))
-    
-    # 创建阴影层
-    shadow_layer = Image.new("RGBA", (shadow_width, shadow_height), (0, 0, 0, 0))
-    draw = ImageDraw.Draw(shadow_layer)
-    
-    # 绘制阴影基础形状（位于中心位置）
-    # 不使用偏移，确保阴影均匀分布在四周
-    shadow_x = shadow_margin
-    shadow_y = shadow_margin
-    draw.rectangle(
-        [(shadow_x, shadow_y), (shadow_x + image.width, shadow_y + image.height)],
-        fill=(0, 0, 0, opacity)
-    )
-    
-    # 应用高斯模糊使阴影变柔滑并向四周扩散
-    # 多次应用模糊可以获得更柔和的效果
-    shadow_layer = shadow_layer.filter(ImageFilter.GaussianBlur(radius=radius))
-    # 再次应用模糊以增强由内向外的渐变效果
-    shadow_layer = shadow_layer.filter(ImageFilter.GaussianBlur(radius=radius//2))
-    
-    # 将阴影层与结果层合并
-    result.paste(shadow_layer, (0, 0), shadow_layer)
+    alpha = soft_shadow_mask(image.size, radius, opacity)
+    result = Image.new("RGBA", alpha.size, (0, 0, 0, 0))
+    result.putalpha(alpha)
     
     # 将原图放置在结果层的中心位置
-    result.paste(image, (shadow_margin, shadow_margin), image)
+    result.paste(image, (shadow_margin, shadow_margin), image if image.mode == "RGBA" else None)
     
     return result
+
+
+class SrgbConverter(object):
+    """
+    将带 ICC 配置文件的图片转换到 sRGB，每种配置文件和图片模式只创建一次转换
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (ICC 配置文件, 图片模式) -> 转换，无需或无法转换时为 None
+        self._transforms = {}
+        self._srgb_profile = None
+
+    def is_available(self) -> bool:
+        return ImageCms is not None
+
+    def get_srgb_profile(self) -> bytes:
+        """
+        :return: sRGB 配置文件，保存图片时嵌入
+        """
+        with self._lock:
+            if self._srgb_profile is None:
+                self._srgb_profile = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+            return self._srgb_profile
+
+    def convert(self, image, icc_profile) -> Image.Image | None:
+        """
+        将图片转换到 sRGB
+        :param image: 图片对象
+        :param icc_profile: 图片的 ICC 配置文件
+        :return: 转换后的新图片对象，配置文件本身就是 sRGB 或无法转换时返回 None，此时应保留原配置文件
+        """
+        if not icc_profile or ImageCms is None:
+            return None
+        transform = self._get_transform(icc_profile, image.mode)
+        if transform is None:
+            return None
+        try:
+            return ImageCms.applyTransform(image, transform)
+        except (ImageCms.PyCMSError, OSError, ValueError) as e:
+            # 配置文件损坏时只影响这一张图片，之后同样的配置文件不再尝试转换
+            logger.warning(f'无法将图片转换到 sRGB，保留原配置文件: {e}')
+            with self._lock:
+                self._transforms[(icc_profile, image.mode)] = None
+            return None
+
+    def _get_transform(self, icc_profile, mode):
+        key = (icc_profile, mode)
+        with self._lock:
+            if key in self._transforms:
+                return self._transforms[key]
+        transform = None
+        try:
+            source = ImageCms.ImageCmsProfile(io.BytesIO(icc_profile))
+            if 'srgb' not in ImageCms.getProfileDescription(source).lower():
+                output_mode = 'RGBA' if mode == 'RGBA' else 'RGB'
+                srgb = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB'))
+                transform = ImageCms.buildTransform(source, srgb, mode, output_mode)
+        except (ImageCms.PyCMSError, OSError, ValueError) as e:
+            logger.warning(f'无法创建 ICC 配置文件到 sRGB 的转换，保留原配置文件: {e}')
+        with self._lock:
+            self._transforms[key] = transform
+        return transform
+
+
+SRGB_CONVERTER = SrgbConverter()
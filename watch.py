@@ -0,0 +1,172 @@
+"""
+监视文件夹 - 新照片写入完成后立即交给批量处理调度器
+不依赖 PyQt5；使用 watchdog 提供的文件系统事件（inotify 等），未安装时退回为定时扫描目录
+"""
+import logging
+import os
+import threading
+from pathlib import Path
+
+from batch import BatchRunner
+from utils import is_image_file
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+logger = logging.getLogger(__name__)
+
+
+class _EventHandler(FileSystemEventHandler):
+    """
+    将 watchdog 的文件事件转发给 FolderWatcher
+    """
+
+    def __init__(self, watcher):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.watcher.notify(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.watcher.notify(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.watcher.notify(event.dest_path)
+
+
+class FolderWatcher(object):
+    """
+    监视输入目录：文件大小和修改时间在两次检查之间不再变化时认为写入完成，随即提交给 BatchRunner；
+    调度器在整个监视期间保持运行，配置、字体、logo 和 exiftool 进程都不会重新加载
+    """
+
+    def __init__(self, runner: BatchRunner, input_dir, process_existing=True, poll_interval=1.0,
+                 settle_interval=0.2, on_detect=None):
+        """
+        :param runner: 批量处理调度器，尚未启动
+        :param input_dir: 输入目录
+        :param process_existing: 是否处理开始监视前已存在的图片
+        :param poll_interval: 没有文件系统事件时扫描目录的间隔，单位为秒
+        :param settle_interval: 判断写入是否完成的检查间隔，单位为秒
+        :param on_detect: 图片写入完成、提交处理时的回调 (图片路径)
+        """
+        self.runner = runner
+        # 文件系统事件给出的可能是绝对路径或真实路径（例如 macOS 的 FSEvents），统一比较解析后的路径
+        self.input_dir = Path(input_dir).resolve()
+        if self.input_dir == Path(runner.output_dir).resolve():
+            raise ValueError('监视模式下输出目录不能与输入目录相同')
+        self.process_existing = process_existing
+        self.poll_interval = poll_interval
+        self.settle_interval = settle_interval
+        self.on_detect = on_detect
+
+        self._lock = threading.Lock()
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        # 等待写入完成的图片 -> 上一次检查时的 (大小, 修改时间)，None 表示尚未检查
+        self._pending = {}
+        # 已提交的图片 -> 提交时的 (大小, 修改时间)，同一版本不重复处理
+        self._submitted = {}
+
+    def notify(self, path) -> None:
+        """
+        通知有文件被创建或修改
+        :param path: 文件路径
+        """
+        path = Path(path)
+        if not is_image_file(path.name) or path.parent.resolve() != self.input_dir:
+            return
+        # 与扫描目录得到的路径一致，同一张图片只记录一次
+        path = self.input_dir.joinpath(path.name)
+        with self._lock:
+            self._pending.setdefault(path, None)
+        self._wake_event.set()
+
+    def run(self) -> None:
+        """
+        开始监视，阻塞直到调用 stop()
+        """
+        self.runner.start()
+        observer = self._start_observer()
+        try:
+            if self.process_existing:
+                self._scan()
+            else:
+                for path, state in self._list_images():
+                    self._submitted[path] = state
+            while not self._stop_event.is_set():
+                if observer is None:
+                    self._scan()
+                with self._lock:
+                    has_pending = bool(self._pending)
+                self._wake_event.wait(self.settle_interval if has_pending else self.poll_interval)
+                self._wake_event.clear()
+                self._check_pending()
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+            self.runner.shutdown()
+
+    def stop(self) -> None:
+        """
+        停止监视，已提交的图片处理完成后 run() 返回
+        """
+        self._stop_event.set()
+        self._wake_event.set()
+
+    def _start_observer(self):
+        if Observer is None:
+            logger.warning(f'未安装 watchdog，改为每 {self.poll_interval} 秒扫描一次目录，新照片要等到下一次扫描才会处理；'
+                           '请执行 pip install -r requirements.txt')
+            return None
+        observer = Observer()
+        observer.schedule(_EventHandler(self), str(self.input_dir), recursive=False)
+        observer.start()
+        return observer
+
+    def _list_images(self):
+        with os.scandir(self.input_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and is_image_file(entry.name):
+                    stat = entry.stat()
+                    yield Path(entry.path), (stat.st_size, stat.st_mtime_ns)
+
+    def _scan(self) -> None:
+        for path, state in self._list_images():
+            if self._submitted.get(path) != state:
+                with self._lock:
+                    self._pending.setdefault(path, None)
+
+    def _check_pending(self) -> None:
+        with self._lock:
+            pending = list(self._pending.items())
+        for path, last_state in pending:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                with self._lock:
+                    self._pending.pop(path, None)
+                continue
+            state = (stat.st_size, stat.st_mtime_ns)
+            if state != last_state or stat.st_size == 0:
+                # 仍在写入，等待下一次检查
+                with self._lock:
+                    self._pending[path] = state
+                continue
+            with self._lock:
+                self._pending.pop(path, None)
+            if self._submitted.get(path) == state:
+                continue
+            self._submitted[path] = state
+            if self.on_detect is not None:
+                self.on_detect(path)
+            self.runner.submit(path)